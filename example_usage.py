@@ -27,6 +27,7 @@ Required environment variables for API mode:
 
 import os
 from masumi import run
+from masumi.hitl import request_input
 
 # Note: .env files are automatically loaded by masumi.run() from the current directory
 
@@ -43,6 +44,15 @@ logger = logging.getLogger(__name__)
 # Agent Logic - This is where you implement your actual agent functionality
 # ─────────────────────────────────────────────────────────────────────────────
 
+# Supported operations, built once at import time instead of an if/elif chain per job
+OPERATIONS = {
+    "uppercase": str.upper,
+    "lowercase": str.lower,
+    "reverse": lambda text: text[::-1],
+    "word_count": lambda text: f"Word count: {len(text.split())}",
+}
+
+
 async def process_job(identifier_from_purchaser: str, input_data: dict):
     """
     Process a job - can be run locally or via Masumi API.
@@ -66,23 +76,8 @@ async def process_job(identifier_from_purchaser: str, input_data: dict):
     text = input_data.get("text", "")
     operation = input_data.get("operation", "uppercase")
     
-    # Process based on operation type
-    if operation == "uppercase":
-        result = text.upper()
-    elif operation == "lowercase":
-        result = text.lower()
-    elif operation == "reverse":
-        result = text[::-1]
-    elif operation == "word_count":
-        words = text.split()
-        result = f"Word count: {len(words)}"
-    else:
-        result = f"Processed: {text}"
-    
     # Example: Human-in-the-loop - request approval before processing
     # This demonstrates how to pause execution and request human input
-    from masumi.hitl import request_input
-    
     # Request approval (this will pause execution until input is provided)
     # The job status will be set to 'awaiting_input' and execution will wait
     # until someone calls the /provide_input endpoint
@@ -107,6 +102,10 @@ async def process_job(identifier_from_purchaser: str, input_data: dict):
         logger.info("Processing was not approved by user")
         return "Processing was not approved"
     
+    # Process based on operation type (only once approved, so rejected jobs cost nothing)
+    operation_handler = OPERATIONS.get(operation)
+    result = operation_handler(text) if operation_handler else f"Processed: {text}"
+    
     logger.info(f"Processing approved. Result: {result[:100]}...")  # Log first 100 chars
     
     # Return result as a string
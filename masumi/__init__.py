@@ -4,16 +4,11 @@ Masumi Payment Module for Cardano blockchain integration.
 
 import warnings
 
-# Load environment variables from .env file if available
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    # python-dotenv is optional, but recommended
-    pass
+# .env files are loaded lazily by the functions that read environment variables
+# (see masumi.config.load_env_file), not at import time
 
 from .config import Config
-from .payment import Payment, Amount
+from .payment import Payment, Amount, create_payment_requests
 from .purchase import Purchase
 from .helper_functions import create_masumi_input_hash, create_masumi_output_hash
 
@@ -74,6 +69,7 @@ __all__ = [
     "Config",
     "Payment", 
     "Amount",
+    "create_payment_requests",
     "Purchase",
     "create_masumi_input_hash",
     "create_masumi_output_hash",
@@ -12,12 +12,15 @@ import importlib
 from typing import Optional, Callable, Dict, Any, Awaitable, Union
 import uvicorn
 
-from .config import Config
+from .config import Config, get_config_from_env, load_env_file, set_current_config
 from .server import MasumiAgentServer, create_masumi_app
 from .helper_functions import setup_logging, ColoredFormatter
 
 logger = setup_logging(__name__)
 
+# Horizontal rule framing the CLI banners and summaries
+_SEPARATOR = "=" * 70
+
 
 def _configure_uvicorn_logging():
     """Configure uvicorn loggers to use our beautiful formatter and prevent duplication."""
@@ -28,11 +31,8 @@ def _configure_uvicorn_logging():
     
     # Remove all existing handlers to prevent duplication
     for log in [uvicorn_logger, uvicorn_access, uvicorn_error]:
-        # Clear all handlers
-        while log.handlers:
-            log.removeHandler(log.handlers[0])
-        # Prevent propagation to root logger to avoid duplicate messages
-        log.propagate = False
+        for h in log.handlers[:]:
+            log.removeHandler(h)
     
     # Create a single shared handler with our formatter
     handler = logging.StreamHandler()
@@ -44,10 +44,12 @@ def _configure_uvicorn_logging():
     uvicorn_access.setLevel(logging.WARNING)  # Suppress verbose HTTP access logs
     uvicorn_error.setLevel(logging.INFO)
     
-    # Add handler to each logger
+    # Attach the handler once, to "uvicorn"; uvicorn.access and uvicorn.error reach it
+    # by propagation, and "uvicorn" itself stops there to avoid duplicates on the root logger
     uvicorn_logger.addHandler(handler)
-    uvicorn_access.addHandler(handler)
-    uvicorn_error.addHandler(handler)
+    uvicorn_logger.propagate = False
+    uvicorn_access.propagate = True
+    uvicorn_error.propagate = True
     
     # Configure root logger to prevent duplicate messages
     # Only modify if it has basicConfig-style handlers
@@ -65,14 +67,34 @@ def _configure_uvicorn_logging():
 
 def _load_dotenv_if_available():
     """Load .env file as a fallback (main.py should load it, but this ensures compatibility)."""
+    # python-dotenv is optional - if not installed, that's okay
+    # (user should install it if they want .env file support)
+    load_env_file()
+
+
+def _run_async(coro):
+    """
+    Run a coroutine to completion, on uvloop when it is installed.
+
+    uvloop ships with uvicorn[standard] on non-Windows platforms. When it is
+    missing (e.g. on Windows) the stock asyncio event loop is used instead.
+    """
     try:
-        from dotenv import load_dotenv
-        # Simple call - load_dotenv() searches from current directory upward automatically
-        load_dotenv()
+        import uvloop
     except ImportError:
-        # python-dotenv is optional - if not installed, that's okay
-        # (user should install it if they want .env file support)
-        pass
+        return asyncio.run(coro)
+
+    if hasattr(uvloop, "run"):
+        return uvloop.run(coro)
+
+    # uvloop < 0.18 has no run(); use a loop of our own instead of a process-wide policy
+    loop = uvloop.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
 
 
 def run(
@@ -113,14 +135,8 @@ def run(
     # API mode - create and run FastAPI server
     # Load config from environment if not provided
     if config is None:
-        config = Config(
-            payment_service_url=os.getenv(
-                "PAYMENT_SERVICE_URL",
-                "https://payment.masumi.network/api/v1"
-            ),
-            payment_api_key=os.getenv("PAYMENT_API_KEY", ""),
-            free_agent=False  # Will be determined by registry check
-        )
+        config = get_config_from_env()
+    set_current_config(config)
     
     # Load agent_identifier from environment if not provided
     if agent_identifier is None:
@@ -163,14 +179,14 @@ def run(
     
     # Display startup information
     display_host = "127.0.0.1" if host == "0.0.0.0" else host
-    print("\n" + "=" * 70)
+    print("\n" + _SEPARATOR)
     print("🚀 Starting Masumi Agent Server...")
-    print("=" * 70)
+    print(_SEPARATOR)
     print(f"API Documentation:        http://{display_host}:{port}/docs")
     print(f"Availability Check:       http://{display_host}:{port}/availability")
     print(f"Input Schema:             http://{display_host}:{port}/input_schema")
     print(f"Start Job:                http://{display_host}:{port}/start_job")
-    print("=" * 70 + "\n")
+    print(_SEPARATOR + "\n")
     
     # Run server with cleaner logging
     # Using log_config=None prevents uvicorn from adding default handlers
@@ -180,6 +196,7 @@ def run(
         host=host, 
         port=port, 
         log_level="info",
+        loop="auto",  # Picks uvloop when installed, falls back to asyncio
         log_config=None  # Use our custom logging config (already configured above)
     )
 
@@ -197,9 +214,9 @@ def _run_standalone(
         input_schema_handler: Input schema dict or callable that returns dict
         input_data: Optional input data (if None, uses defaults from schema or empty dict)
     """
-    print("\n" + "=" * 70)
+    print("\n" + _SEPARATOR)
     print("Running Agent Locally (Standalone Mode)")
-    print("=" * 70)
+    print(_SEPARATOR)
     
     # Get input data
     if input_data is None:
@@ -230,7 +247,7 @@ def _run_standalone(
     
     # Execute handler
     try:
-        result = asyncio.run(start_job_handler(identifier_from_purchaser, input_data))
+        result = _run_async(start_job_handler(identifier_from_purchaser, input_data))
         print("\n✅ Agent execution completed!")
         print(f"\nResult:")
         if isinstance(result, dict):
@@ -242,7 +259,7 @@ def _run_standalone(
         import traceback
         traceback.print_exc()
     
-    print("\n" + "=" * 70 + "\n")
+    print("\n" + _SEPARATOR + "\n")
 
 
 def _load_module_from_file(file_path: str):
@@ -297,7 +314,7 @@ def run_command(args):
     # Check for help flag
     if "--help" in args or "-h" in args:
         print("Masumi Agent Builder CLI - Run Command")
-        print("=" * 70)
+        print(_SEPARATOR)
         print("\nRun an agent file (API mode by default)")
         print("\nUsage:")
         print("  masumi run [file.py] [OPTIONS]")
@@ -415,7 +432,7 @@ def init_command(args):
     # Check for help flag
     if "--help" in args or "-h" in args:
         print("Masumi Agent Builder CLI - Init Command")
-        print("=" * 70)
+        print(_SEPARATOR)
         print("\nGenerate a new Masumi agent project with full structure")
         print("\nUsage:")
         print("  masumi init [OPTIONS]")
@@ -461,7 +478,7 @@ def check_command(args):
     # Check for help flag
     if "--help" in args or "-h" in args:
         print("Masumi Agent Builder CLI - Check Command")
-        print("=" * 70)
+        print(_SEPARATOR)
         print("\nValidate your Masumi environment and configuration")
         print("\nUsage:")
         print("  masumi check [OPTIONS]")
@@ -485,7 +502,7 @@ def check_command(args):
     # Run the checker
     from .checker import run_check
     try:
-        exit_code = asyncio.run(run_check(verbose=verbose))
+        exit_code = _run_async(run_check(verbose=verbose))
         sys.exit(exit_code)
     except KeyboardInterrupt:
         print("\n\nCheck interrupted by user.")
@@ -500,10 +517,10 @@ def check_command(args):
 def show_help():
     """Display comprehensive help information."""
     print("Masumi Agent Builder CLI")
-    print("=" * 70)
+    print(_SEPARATOR)
     print("\nA command-line tool for building and running Masumi agents with")
     print("integrated payment processing.")
-    print("\n" + "=" * 70)
+    print("\n" + _SEPARATOR)
     print("\nCOMMANDS")
     print("-" * 70)
 
@@ -550,7 +567,7 @@ def show_help():
     print("      masumi check                    # Quick check (only shows issues)")
     print("      masumi check --verbose          # Detailed check (shows everything)")
 
-    print("\n" + "=" * 70)
+    print("\n" + _SEPARATOR)
     print("\nENVIRONMENT VARIABLES")
     print("-" * 70)
     print("\n  Required for API mode:")
@@ -564,7 +581,7 @@ def show_help():
     print("\n  Note: Environment variables can be set in a .env file")
     print("        (.env files are automatically loaded)")
     
-    print("\n" + "=" * 70)
+    print("\n" + _SEPARATOR)
     print("\nQUICK START")
     print("-" * 70)
     print("\n  1. Generate a new agent project:")
@@ -583,7 +600,7 @@ def show_help():
     print("\n  5. Run your agent:")
     print("     masumi run agent.py")
     
-    print("\n" + "=" * 70)
+    print("\n" + _SEPARATOR)
     print()
 
 
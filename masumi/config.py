@@ -1,3 +1,119 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+import aiohttp
+
+DEFAULT_PAYMENT_SERVICE_URL = "https://payment.masumi.network/api/v1"
+
+# JSON codec for payment service requests/responses: orjson when installed
+# (pip install masumi[speedups]), the standard library otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj: Any) -> str:
+    """Serialize a request body to a JSON string."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
+
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    """
+    Serialize a request body to UTF-8 JSON bytes, for use as data= on a request.
+
+    orjson produces bytes directly, so this skips the bytes -> str -> bytes round trip
+    that json= (and json_dumps) goes through.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Parse a JSON response body."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+async def read_json(response: aiohttp.ClientResponse) -> Any:
+    """
+    Parse the JSON body of a payment service response.
+
+    With orjson the raw bytes are parsed directly, skipping aiohttp's decode to str;
+    otherwise this is response.json().
+    """
+    if orjson is not None:
+        return orjson.loads(await response.read())
+    return await response.json()
+
+
+async def read_text(response: aiohttp.ClientResponse) -> str:
+    """
+    Read a response body as text for error messages and logs.
+
+    Decodes as UTF-8 (undecodable bytes replaced) instead of response.text(),
+    which runs charset detection when the response declares no charset.
+    """
+    return (await response.read()).decode("utf-8", "replace")
+
+
+# API keys the payment service answered with 401, and when (time.monotonic()).
+# Shared by every Payment and Purchase in the process, keyed by the key itself.
+_rejected_api_keys: Dict[str, float] = {}
+REJECTED_API_KEY_RETRY_SECONDS = 60
+
+
+def record_rejected_api_key(api_key: str) -> None:
+    """Remember that the payment service rejected api_key (HTTP 401)."""
+    _rejected_api_keys[api_key] = time.monotonic()
+
+
+def raise_if_api_key_rejected(api_key: str) -> None:
+    """
+    Fail fast for an API key the payment service rejected recently.
+
+    Raises the same ValueError as a 401 response, without a request, until
+    REJECTED_API_KEY_RETRY_SECONDS have passed; the next call then tries the key
+    again, so a key fixed on the service side is picked up without a restart.
+    """
+    rejected_at = _rejected_api_keys.get(api_key)
+    if rejected_at is None:
+        return
+    if time.monotonic() - rejected_at < REJECTED_API_KEY_RETRY_SECONDS:
+        raise ValueError("Unauthorized: Invalid API key")
+    _rejected_api_keys.pop(api_key, None)
+
+
+@asynccontextmanager
+async def post_json(config: "Config", url: str, headers: Any,
+                    payload: Any) -> AsyncIterator[aiohttp.ClientResponse]:
+    """
+    POST a JSON payload to the payment service; use as `async with post_json(...) as response`.
+
+    Every Payment and Purchase POST goes through here, so the transport is set up in one place:
+    the config's shared session, the body encoded with json_dumps_bytes, and fail-fast for a key
+    the service rejected with 401 (see raise_if_api_key_rejected).
+    """
+    raise_if_api_key_rejected(config.payment_api_key)
+    async with config.get_http_session().post(
+        url, headers=headers, data=json_dumps_bytes(payload)
+    ) as response:
+        if response.status == 401:
+            record_rejected_api_key(config.payment_api_key)
+        yield response
+
+
 class Config:
     """
     Centralized configuration for the masumi package.
@@ -5,13 +121,31 @@ class Config:
     Holds configuration values for payment service and network addresses.
     The payment service URL also hosts the registry endpoint (/registry/{agent-identifier}).
     For free agents (free_agent=True), payment credentials are optional.
+
+    The config also owns the keep-alive HTTP session shared by every Payment and
+    Purchase built from it (see get_http_session()).
     """
 
+    __slots__ = (
+        "payment_service_url", "payment_api_key", "registry_service_url", "registry_api_key",
+        "preprod_address", "mainnet_address", "free_agent", "http_session",
+        "_owned_session", "_owned_session_loop",
+    )
+
+    # Connection pool of the owned session. Nearly all SDK traffic goes to the payment
+    # service host, and aiohttp speaks HTTP/1.1 only, so concurrent status polls are
+    # spread over a bounded set of kept-alive connections to that host instead of
+    # opening a new TCP/TLS connection per in-flight request. Override in a subclass to tune.
+    HTTP_CONNECTION_LIMIT = 100
+    HTTP_CONNECTION_LIMIT_PER_HOST = 16
+    HTTP_KEEPALIVE_TIMEOUT = 75
+
     def __init__(self, payment_service_url: str = None, payment_api_key: str = None,
                  registry_service_url: str = None, registry_api_key: str = None,
                  preprod_address: str = None,
                  mainnet_address: str = None,
-                 free_agent: bool = False):
+                 free_agent: bool = False,
+                 http_session: Optional[aiohttp.ClientSession] = None):
         self.payment_service_url = payment_service_url or ""
         self.payment_api_key = payment_api_key or ""
         self.registry_service_url = registry_service_url
@@ -19,6 +153,9 @@ class Config:
         self.preprod_address = preprod_address
         self.mainnet_address = mainnet_address
         self.free_agent = free_agent
+        self.http_session = http_session
+        self._owned_session: Optional[aiohttp.ClientSession] = None
+        self._owned_session_loop: Optional[asyncio.AbstractEventLoop] = None
         self._validate()
 
     def _validate(self):
@@ -31,6 +168,8 @@ class Config:
         """
         if self.free_agent:
             return  # Free agents skip payment service; no validation needed
+        if self.payment_service_url and self.payment_api_key:
+            return  # Common case: nothing missing, nothing to build
         missing_configs = []
         if not self.payment_service_url:
             missing_configs.append("PAYMENT_SERVICE_URL")
@@ -40,3 +179,135 @@ class Config:
             error_msg = f"Missing required configuration parameters: {', '.join(missing_configs)}"
             error_msg += "\n\nRun 'masumi check' for detailed diagnostics and setup instructions."
             raise ValueError(error_msg)
+
+    def get_http_session(self) -> aiohttp.ClientSession:
+        """
+        Return the HTTP session used for payment service calls.
+
+        A session passed in as http_session is always used as-is. Otherwise a
+        keep-alive session is created lazily on the running event loop and reused
+        for every subsequent call, so TCP/TLS handshakes are not repeated per request.
+        Must be called from within a coroutine.
+        """
+        if self.http_session is not None:
+            return self.http_session
+
+        loop = asyncio.get_running_loop()
+        if (
+            self._owned_session is None
+            or self._owned_session.closed
+            or self._owned_session_loop is not loop
+        ):
+            self._discard_owned_session()
+            connector = aiohttp.TCPConnector(
+                limit=self.HTTP_CONNECTION_LIMIT,
+                limit_per_host=self.HTTP_CONNECTION_LIMIT_PER_HOST,
+                keepalive_timeout=self.HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            self._owned_session = aiohttp.ClientSession(connector=connector, json_serialize=json_dumps)
+            self._owned_session_loop = loop
+        return self._owned_session
+
+    def _discard_owned_session(self) -> None:
+        """
+        Release the owned session before get_http_session() replaces it.
+
+        A session whose loop still runs (in another thread) is closed on that loop.
+        Otherwise nothing will drive its loop again, so it is closed on a short-lived
+        loop instead. That loop runs in a helper thread because the calling thread
+        already runs one.
+        """
+        session, session_loop = self._owned_session, self._owned_session_loop
+        self._owned_session = None
+        self._owned_session_loop = None
+        if session is None or session.closed:
+            return
+        if session_loop is not None and session_loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+            return
+        closer = threading.Thread(target=asyncio.run, args=(session.close(),), name="masumi-session-close")
+        closer.start()
+        closer.join()
+
+    async def close(self) -> None:
+        """
+        Close the HTTP session created by get_http_session().
+
+        Sessions supplied by the caller via http_session are left open; their
+        lifetime belongs to the caller.
+        """
+        if self._owned_session is not None and not self._owned_session.closed:
+            await self._owned_session.close()
+        self._owned_session = None
+        self._owned_session_loop = None
+
+    async def __aenter__(self) -> "Config":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+
+@functools.lru_cache(maxsize=1)
+def load_env_file() -> None:
+    """
+    Load variables from a .env file into the environment, once per process.
+
+    Called by the functions that fall back to environment variables
+    (get_config_from_env, the agent server, masumi.run) rather than at import time,
+    so code that passes its configuration explicitly never searches for a .env file.
+    python-dotenv is optional; without it this does nothing.
+    """
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+# Config for the current context (task), used by Payment when no config is passed
+_current_config: ContextVar[Optional[Config]] = ContextVar('masumi_config', default=None)
+
+
+def set_current_config(config: Optional[Config]) -> None:
+    """
+    Set the Config used by Payment(...) calls that omit config= in the current context.
+
+    The value is scoped like any ContextVar: tasks created afterwards inherit it, and
+    setting it inside a task does not affect other tasks. Pass None to clear it.
+    """
+    _current_config.set(config)
+
+
+def get_current_config() -> Config:
+    """
+    Return the Config set with set_current_config(), falling back to get_config_from_env().
+
+    Raises:
+        ValueError: If no config is set and PAYMENT_API_KEY is not set
+    """
+    config = _current_config.get()
+    if config is None:
+        config = get_config_from_env()
+    return config
+
+
+@functools.lru_cache(maxsize=1)
+def get_config_from_env() -> Config:
+    """
+    Build a Config from environment variables, once per process.
+
+    Reads PAYMENT_SERVICE_URL (defaults to production) and PAYMENT_API_KEY.
+    Later calls return the same instance, so its HTTP session is shared as well.
+    Use get_config_from_env.cache_clear() after changing the environment.
+
+    Raises:
+        ValueError: If PAYMENT_API_KEY is not set
+    """
+    load_env_file()
+    return Config(
+        payment_service_url=os.getenv("PAYMENT_SERVICE_URL", DEFAULT_PAYMENT_SERVICE_URL),
+        payment_api_key=os.getenv("PAYMENT_API_KEY", ""),
+        free_agent=False  # Will be determined by registry check
+    )
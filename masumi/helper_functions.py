@@ -1,12 +1,21 @@
+import asyncio
+import atexit
+import dataclasses
+import functools
 import hashlib
 import json
-import canonicaljson
-import logging as logger
 import logging
-import sys
+import logging as logger
+import logging.handlers
 import os
+import queue
+import sys
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
 import aiohttp
-from typing import Optional
+import canonicaljson
+
+from .config import DEFAULT_PAYMENT_SERVICE_URL, json_loads, load_env_file
 
 
 class ColoredFormatter(logging.Formatter):
@@ -94,7 +103,89 @@ class ColoredFormatter(logging.Formatter):
         return formatted
 
 
-def setup_logging(name, level=logging.INFO, use_colors=True, use_emojis=True):
+_log_listener: Optional[logging.handlers.QueueListener] = None
+_log_listener_stopped = False
+
+
+class _ConsoleQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler feeding the shared console writer thread.
+
+    Once the writer has stopped (at interpreter exit), or in a child process forked
+    after it started (which inherits the queue but not the thread), records are written
+    to the console directly instead of going into a queue nobody reads.
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue, console_handler: logging.Handler):
+        super().__init__(log_queue)
+        self.console_handler = console_handler
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if _log_listener_stopped:
+            try:
+                self.console_handler.handle(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+            return
+        super().emit(record)
+
+
+def _stop_log_listener() -> None:
+    """
+    Stop the console writer thread, flushing every record queued so far.
+
+    Handlers switch to direct writes first, so records logged during and after
+    shutdown (e.g. by other atexit hooks) still reach the console.
+    """
+    global _log_listener_stopped
+    if _log_listener is None or _log_listener_stopped:
+        return
+    _log_listener_stopped = True
+    _log_listener.stop()
+    # Records queued after the stop sentinel, by threads that raced the switch above
+    while True:
+        try:
+            record = _log_listener.queue.get_nowait()
+        except queue.Empty:
+            break
+        _log_listener.handle(record)
+
+
+def _write_logs_directly_in_child() -> None:
+    """After os.fork(): the writer thread did not survive, so handlers write directly."""
+    global _log_listener_stopped
+    _log_listener_stopped = True
+
+
+def create_queue_log_handler(formatter: logging.Formatter) -> logging.Handler:
+    """
+    Create a handler that formats records in the calling thread and hands them to a
+    single background thread for writing to stderr.
+
+    Opt-in (see setup_logging(use_queue=True)): keeps the blocking console write (and
+    its I/O lock) off the event loop thread. The shared writer is started on first use
+    and drained at interpreter exit; after that, and in processes forked from this one,
+    the handler writes directly.
+    """
+    global _log_listener
+    if _log_listener is None:
+        log_queue = queue.SimpleQueue()
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        _log_listener = logging.handlers.QueueListener(log_queue, console_handler)
+        _log_listener.start()
+        # atexit runs hooks last-registered-first: this one runs after hooks registered
+        # later than the writer started, so their log records are flushed too
+        atexit.register(_stop_log_listener)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_write_logs_directly_in_child)
+
+    queue_handler = _ConsoleQueueHandler(_log_listener.queue, _log_listener.handlers[0])
+    queue_handler.setFormatter(formatter)
+    return queue_handler
+
+
+def setup_logging(name, level=logging.INFO, use_colors=True, use_emojis=True, use_queue=False):
     """
     Centralized logging configuration for Masumi modules.
     
@@ -106,6 +197,8 @@ def setup_logging(name, level=logging.INFO, use_colors=True, use_emojis=True):
         level: Logging level (default: logging.INFO)
         use_colors: Whether to use colors (default: True, auto-detects TTY)
         use_emojis: Whether to use emojis for log levels (default: True)
+        use_queue: Write console output from a background thread instead of the
+                   logging thread (default: False, see create_queue_log_handler)
     
     Returns:
         logging.Logger: Configured logger instance
@@ -117,10 +210,13 @@ def setup_logging(name, level=logging.INFO, use_colors=True, use_emojis=True):
     logger_instance.propagate = False
     
     if not logger_instance.handlers:
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
         formatter = ColoredFormatter(use_colors=use_colors, use_emojis=use_emojis)
-        console_handler.setFormatter(formatter)
+        if use_queue:
+            console_handler = create_queue_log_handler(formatter)
+        else:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(formatter)
+        console_handler.setLevel(level)
         logger_instance.addHandler(console_handler)
     
     return logger_instance
@@ -132,23 +228,45 @@ def _create_hash_from_payload(payload_string: str, identifier_from_purchaser: st
     """
     # Steps 1.2, 2.2: Construct the pre-image with a semicolon delimiter.
     string_to_hash = f"{identifier_from_purchaser};{payload_string}"
-    logger.debug(f"Pre-image for hashing: {string_to_hash}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logger.debug(f"Pre-image for hashing: {string_to_hash}")
 
     # Steps 1.3, 2.3: Encode to UTF-8 and hash with SHA-256.
     return hashlib.sha256(string_to_hash.encode('utf-8')).hexdigest()
 
-def create_masumi_input_hash(input_data: dict, identifier_from_purchaser: str) -> str:
+def create_masumi_input_hash(input_data: Any, identifier_from_purchaser: str) -> str:
     """
     Creates an input hash according to MIP-004.
     This function handles the specific pre-processing for input data (JCS).
+    input_data may be a dict or a dataclass instance (e.g. a slotted, frozen input type),
+    which is converted to a dict first.
     """
+    if dataclasses.is_dataclass(input_data) and not isinstance(input_data, type):
+        input_data = dataclasses.asdict(input_data)
+
     # Step 1.1: Serialize the input dict using JCS (RFC 8785).
     canonical_input_json_string = canonicaljson.encode_canonical_json(input_data).decode('utf-8')
-    logger.debug(f"Canonical Input JSON: {canonical_input_json_string}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logger.debug(f"Canonical Input JSON: {canonical_input_json_string}")
 
     # Call the core hashing function with the processed data.
     return _create_hash_from_payload(canonical_input_json_string, identifier_from_purchaser)
 
+async def create_masumi_input_hash_async(input_data: Any, identifier_from_purchaser: str) -> str:
+    """
+    Async variant of create_masumi_input_hash for use inside coroutines.
+    Canonicalization and hashing run in the default executor, so the work can overlap
+    with network I/O (e.g. the registry lookup in /start_job) instead of blocking the loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, create_masumi_input_hash, input_data, identifier_from_purchaser
+    )
+
+# The string encoder json.dumps(s, ensure_ascii=False) ends up calling (C-accelerated),
+# bound once instead of building a JSONEncoder for every output hash
+_encode_json_string = json.encoder.encode_basestring
+
 def create_masumi_output_hash(output_string: str, identifier_from_purchaser: str) -> str:
     """
     Creates an output hash according to MIP-004.
@@ -159,29 +277,113 @@ def create_masumi_output_hash(output_string: str, identifier_from_purchaser: str
         raise TypeError("output_string must be a string")
 
     # Step 2.1: Escape special characters in the result string using JSON encoding
-    escaped_output = json.dumps(output_string, ensure_ascii=False)[1:-1]
-    logger.info(f"Escaped Output for hashing: {escaped_output}")
+    escaped_output = _encode_json_string(output_string)[1:-1]
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logger.info(f"Escaped Output for hashing: {escaped_output}")
 
     # Call the core hashing function with the processed data.
     result_hash = _create_hash_from_payload(escaped_output, identifier_from_purchaser)
     logger.info(f"Generated Output Hash: {result_hash}")
     return result_hash
 
+# Outputs at least this long (in characters) are hashed off the event loop
+OUTPUT_HASH_OFFLOAD_THRESHOLD = 64 * 1024
+
+async def create_masumi_output_hash_async(output_string: str, identifier_from_purchaser: str) -> str:
+    """
+    Async variant of create_masumi_output_hash for use inside coroutines.
+    Large outputs are escaped and hashed in the default executor so the event loop
+    (and every other payment monitor on it) is not blocked; small outputs are
+    hashed inline since a thread hop would cost more than the hash itself.
+    """
+    if not isinstance(output_string, str):
+        raise TypeError("output_string must be a string")
+
+    if len(output_string) < OUTPUT_HASH_OFFLOAD_THRESHOLD:
+        return create_masumi_output_hash(output_string, identifier_from_purchaser)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, create_masumi_output_hash, output_string, identifier_from_purchaser
+    )
+
+
+T = TypeVar("T")
+
+# Failures worth retrying: the request may not have reached the service or its answer was lost
+TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (aiohttp.ClientError, asyncio.TimeoutError)
+# Failures to open a connection: the request was never sent, so even a
+# non-idempotent POST can be retried without risking a duplicate
+CONNECT_ERRORS: Tuple[Type[BaseException], ...] = (aiohttp.ClientConnectorError,)
+
+
+async def retry_async(func: Callable[..., Awaitable[T]], *args: Any, attempts: int = 3,
+                      base_delay: float = 1.0, max_delay: float = 60.0,
+                      retry_on: Tuple[Type[BaseException], ...] = CONNECT_ERRORS) -> T:
+    """
+    Await func(*args), retrying transient failures with exponential backoff.
+
+    Only exceptions in retry_on are retried (failed connection attempts by default);
+    anything else, including cancellation, propagates immediately. Waits use
+    asyncio.sleep, doubling from base_delay up to max_delay between attempts.
+
+    The default never sends a request twice. Pass retry_on=TRANSIENT_ERRORS to also
+    retry dropped connections and timeouts, but only for idempotent requests: the
+    server may already have acted on the lost attempt.
+
+    Args:
+        func: Coroutine function to call
+        *args: Positional arguments for func
+        attempts: Total number of calls before the last error is raised (default: 3)
+        base_delay: Delay in seconds after the first failure (default: 1.0)
+        max_delay: Upper bound for the delay in seconds (default: 60.0)
+        retry_on: Exception types that trigger a retry (default: CONNECT_ERRORS)
+
+    Returns:
+        The result of the first successful call
+    """
+    delay = base_delay
+    for attempt in range(1, attempts + 1):
+        try:
+            return await func(*args)
+        except retry_on as e:
+            if attempt >= attempts:
+                raise
+            logger.warning(f"Attempt {attempt}/{attempts} of {getattr(func, '__name__', func)} failed: {e}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(max_delay, delay * 2)
+
+
+@functools.lru_cache(maxsize=1)
+def _registry_env_defaults() -> Tuple[str, str]:
+    """
+    Snapshot of the PAYMENT_SERVICE_URL / PAYMENT_API_KEY fallbacks, read once per process
+    (like get_config_from_env) instead of on every registry query.
+    """
+    load_env_file()
+    return (
+        os.getenv("PAYMENT_SERVICE_URL", DEFAULT_PAYMENT_SERVICE_URL),
+        os.getenv("PAYMENT_API_KEY", ""),
+    )
 
 async def check_free_agent_from_registry(
     agent_identifier: str,
     payment_service_url: Optional[str] = None,
     payment_api_key: Optional[str] = None,
-    network: str = "Preprod"
+    network: str = "Preprod",
+    http_session: Optional[aiohttp.ClientSession] = None
 ) -> bool:
     """
     Query the registry to check if an agent is marked as free.
 
     Args:
         agent_identifier: The agent identifier to check
-        payment_service_url: URL of the payment service (same service hosts registry endpoint)
-        payment_api_key: API key for the service
+        payment_service_url: URL of the payment service (same service hosts registry endpoint).
+            Falls back to PAYMENT_SERVICE_URL, read once per process
+        payment_api_key: API key for the service. Falls back to PAYMENT_API_KEY, read once per process
         network: The Cardano network (Preprod or Mainnet)
+        http_session: Optional shared session to reuse (e.g. Config.get_http_session());
+            a temporary session is opened when omitted
 
     Returns:
         bool: True if the agent is marked as free, False otherwise
@@ -189,16 +391,11 @@ async def check_free_agent_from_registry(
     Raises:
         Exception: If registry query fails
     """
-    # Use default payment service URL if not provided
-    if not payment_service_url:
-        payment_service_url = os.getenv(
-            "PAYMENT_SERVICE_URL",
-            "https://payment.masumi.network/api/v1"
-        )
-
-    # Load API key from env if not provided
-    if not payment_api_key:
-        payment_api_key = os.getenv("PAYMENT_API_KEY", "")
+    # Fall back to the environment snapshot for anything not provided
+    if not payment_service_url or not payment_api_key:
+        env_service_url, env_api_key = _registry_env_defaults()
+        payment_service_url = payment_service_url or env_service_url
+        payment_api_key = payment_api_key or env_api_key
 
     if not agent_identifier or agent_identifier == "unregistered-agent":
         # If agent is not registered, assume not free (default behavior)
@@ -219,12 +416,12 @@ async def check_free_agent_from_registry(
     try:
         # Build headers - try both token and x-api-key for compatibility
         # Payment endpoints use "token", registry might use "x-api-key"
+        # GET without a body: no Content-Type
         headers = {
-            "Content-Type": "application/json",
             "token": payment_api_key,
             "x-api-key": payment_api_key
         }
-        logging.info(f"Registry auth: Using API key {payment_api_key[:8] if payment_api_key else 'NONE'}... (masked)")
+        logging.debug("Registry auth: using the payment API key (not logged)")
 
         # Registry endpoint is under /api/v1/ on the payment service
         # Use the payment_service_url directly (it already includes /api/v1)
@@ -239,15 +436,18 @@ async def check_free_agent_from_registry(
         }
         logging.info(f"Querying registry at: {url}?agentIdentifier={agent_identifier[:8]}...&network={network}")
 
-        async with aiohttp.ClientSession() as session:
+        owns_session = http_session is None
+        session = aiohttp.ClientSession() if owns_session else http_session
+        try:
             async with session.get(url, headers=headers, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response_text = await response.text()
+                # Decoded to text only for the log messages of the failure paths
+                body = await response.read()
 
                 if response.status == 404:
                     # Agent not found in registry - assume not free
                     logging.warning(
                         f"Agent {agent_identifier[:8]}... not found in registry (404). "
-                        f"Response: {response_text}. "
+                        f"Response: {body.decode('utf-8', 'replace')}. "
                         "Assuming non-free agent. Register your agent first."
                     )
                     return False
@@ -255,16 +455,16 @@ async def check_free_agent_from_registry(
                 if response.status != 200:
                     logging.error(
                         f"Registry query failed with status {response.status}. "
-                        f"Response: {response_text}. "
+                        f"Response: {body.decode('utf-8', 'replace')}. "
                         "Assuming non-free agent."
                     )
                     return False
 
                 # Parse response
                 try:
-                    data = await response.json()
+                    data = json_loads(body)
                 except Exception as e:
-                    logging.error(f"Failed to parse registry response as JSON: {response_text}. Error: {e}")
+                    logging.error(f"Failed to parse registry response as JSON: {body.decode('utf-8', 'replace')}. Error: {e}")
                     return False
 
                 logging.info(f"Registry response for agent {agent_identifier[:8]}...: {data}")
@@ -297,6 +497,9 @@ async def check_free_agent_from_registry(
                 )
 
                 return is_free
+        finally:
+            if owns_session:
+                await session.close()
 
     except aiohttp.ClientError as e:
         logging.error(
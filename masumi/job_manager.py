@@ -2,16 +2,28 @@
 Job state management with pluggable storage interface.
 """
 
-from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any
-import uuid
 import logging
-from .payment import Payment
-from .helper_functions import setup_logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .helper_functions import CONNECT_ERRORS, retry_async, setup_logging
 from .models import JobStatus
+from .payment import Payment
 
 logger = setup_logging(__name__)
 
+# Job statuses after which a job's Payment instance is no longer needed
+FINAL_JOB_STATUSES = frozenset({JobStatus.COMPLETED.value, JobStatus.FAILED.value})
+
+
+def _timestamp_seconds(value: float) -> float:
+    """Unix timestamp in seconds from payment service times (milliseconds) or free-agent mock times (seconds)."""
+    value = float(value)
+    return value / 1000 if value > 1e11 else value
+
 
 class JobStorage(ABC):
     """Abstract base class for job storage backends."""
@@ -92,15 +104,41 @@ class InMemoryJobStorage(JobStorage):
 class JobManager:
     """Manages job lifecycle and state tracking."""
     
-    def __init__(self, storage: Optional[JobStorage] = None):
+    DEFAULT_MAX_PAYMENT_INSTANCES = 10000
+
+    # Attempts and initial backoff (seconds, doubled per retry) for submitting a
+    # result on-chain when no connection to the payment service can be opened. Override in a subclass to tune.
+    RESULT_SUBMIT_ATTEMPTS = 3
+    RESULT_SUBMIT_RETRY_DELAY = 1.0
+    
+    # How long after payByTime an unpaid job keeps its Payment instance, so a payment
+    # made just before the deadline is still seen by the (polling) status monitor
+    PAYMENT_DEADLINE_GRACE_SECONDS = 3600
+    
+    def __init__(self, storage: Optional[JobStorage] = None,
+                 max_payment_instances: int = DEFAULT_MAX_PAYMENT_INSTANCES):
         """
         Initialize the job manager.
         
         Args:
             storage: Storage backend (defaults to InMemoryJobStorage)
+            max_payment_instances: Upper bound on tracked Payment instances. When exceeded,
+                                   the oldest instances of completed or failed jobs are
+                                   dropped; instances of live jobs are never dropped, since
+                                   their result still has to be submitted on-chain. Jobs
+                                   still awaiting payment PAYMENT_DEADLINE_GRACE_SECONDS after
+                                   their payByTime are dropped regardless of the limit: they
+                                   can no longer be paid.
         """
         self.storage = storage or InMemoryJobStorage()
-        self._payment_instances: Dict[str, Payment] = {}
+        self.max_payment_instances = max_payment_instances
+        # Live jobs (awaiting payment or input, running), least recently used first
+        self._payment_instances: "OrderedDict[str, Payment]" = OrderedDict()
+        # Completed or failed jobs not yet released, oldest first; the only ones evicted for the limit
+        self._finished_payment_instances: "OrderedDict[str, Payment]" = OrderedDict()
+        # Expiry time (payByTime plus grace, in seconds) of jobs awaiting payment, in creation order
+        self._payment_deadlines: "OrderedDict[str, float]" = OrderedDict()
+        self._over_limit_warned = False
         logger.info("Initialized JobManager")
     
     async def create_job(
@@ -144,7 +182,9 @@ class JobManager:
         }
         
         await self.storage.create_job(job_id, job_data)
-        self._payment_instances[job_id] = payment
+        # Free agent jobs run at once and have no payment deadline
+        deadline = None if blockchain_identifier.startswith("FREE-") else pay_by_time
+        self._track_payment_instance(job_id, payment, deadline)
         
         logger.info(f"Created job {job_id} with status 'awaiting_payment'")
         return job_id
@@ -157,6 +197,10 @@ class JobManager:
         """Update job status and optionally other fields."""
         updates = {"status": status, **kwargs}
         await self.storage.update_job(job_id, updates)
+        if status != JobStatus.AWAITING_PAYMENT.value:
+            self._payment_deadlines.pop(job_id, None)
+        if status in FINAL_JOB_STATUSES and job_id in self._payment_instances:
+            self._finished_payment_instances[job_id] = self._payment_instances.pop(job_id)
         logger.info(f"Updated job {job_id} status to '{status}'")
     
     async def set_job_running(self, job_id: str) -> None:
@@ -178,23 +222,34 @@ class JobManager:
         payment = self.get_payment_instance(job_id)
         job = await self.get_job(job_id)
         
-        if payment and job and job.get("payment_id"):
+        if job and job.get("payment_id"):
             payment_id = job.get("payment_id")
             # Free agent jobs use FREE-* identifiers; skip payment service (no on-chain submission)
             if payment_id.startswith("FREE-"):
                 logger.info(f"Free agent job {job_id} (payment ID: {payment_id}) — skipping on-chain submission")
+            elif payment is None:
+                # Never mark a paid job completed without submitting its result
+                logger.error(f"On-chain result submission FAILED for job {job_id}: payment instance missing")
+                raise ValueError(f"Payment instance for job {job_id} not found; result not submitted")
             else:
                 logger.info(f"Submitting result on-chain for job {job_id} (payment ID: {payment_id})")
                 logger.info(f"Result length: {len(result)} characters")
                 try:
-                    await payment.complete_payment(payment_id, result)
+                    # An unreachable payment service should not fail a job whose work is
+                    # already done. Only connection failures are retried: submit-result is
+                    # not idempotent, and a request the service may have received is not re-sent.
+                    await retry_async(
+                        payment.complete_payment, payment_id, result,
+                        attempts=self.RESULT_SUBMIT_ATTEMPTS,
+                        base_delay=self.RESULT_SUBMIT_RETRY_DELAY,
+                        retry_on=CONNECT_ERRORS
+                    )
                     logger.info(f"Result submitted on-chain successfully for job {job_id}")
                 except Exception as e:
                     logger.error(f"On-chain result submission FAILED for job {job_id}: {str(e)}")
                     raise
         else:
             reason = []
-            if not payment: reason.append("payment instance missing")
             if not job: reason.append("job data missing")
             if job and not job.get("payment_id"): reason.append("payment_id missing in job data")
             logger.error(f"SKIPPING on-chain submission for job {job_id}. Reasons: {', '.join(reason)}")
@@ -262,16 +317,86 @@ class JobManager:
         )
         logger.info(f"Job {job_id} resumed with input data")
     
+    def _track_payment_instance(self, job_id: str, payment: Payment,
+                                pay_by_time: Optional[float] = None) -> None:
+        """
+        Store a live job's payment instance and enforce max_payment_instances.
+        
+        Jobs still awaiting payment well after pay_by_time are dropped first, then the
+        oldest finished jobs while over the limit. Live jobs (awaiting payment or
+        input, running) are never evicted: completing one needs its Payment to
+        submit the result, so if only live jobs remain the limit is exceeded (with
+        one warning) until they finish.
+        """
+        self._finished_payment_instances.pop(job_id, None)
+        self._payment_instances[job_id] = payment
+        self._payment_instances.move_to_end(job_id)
+        if pay_by_time is not None:
+            self._payment_deadlines[job_id] = _timestamp_seconds(pay_by_time) + self.PAYMENT_DEADLINE_GRACE_SECONDS
+        
+        self._expire_unpaid_payment_instances()
+        while self._finished_payment_instances and self._payment_instance_count() > self.max_payment_instances:
+            evicted_job_id, _ = self._finished_payment_instances.popitem(last=False)
+            logger.debug(f"Payment instance limit ({self.max_payment_instances}) reached, evicted finished job {evicted_job_id}")
+        
+        if self._payment_instance_count() <= self.max_payment_instances:
+            self._over_limit_warned = False
+        elif not self._over_limit_warned:
+            self._over_limit_warned = True
+            logger.warning(
+                f"Payment instance limit ({self.max_payment_instances}) exceeded by live jobs; "
+                f"keeping them until they finish or their payment deadline passes"
+            )
+    
+    def _expire_unpaid_payment_instances(self) -> None:
+        """
+        Drop jobs still awaiting payment PAYMENT_DEADLINE_GRACE_SECONDS after their payByTime.
+        
+        Checked in creation order, stopping at the first deadline still ahead: the
+        payment service sets payByTime a fixed offset after creation, so later jobs
+        have later deadlines. This keeps the check O(1) per new job.
+        """
+        now = time.time()
+        while self._payment_deadlines:
+            job_id, deadline = next(iter(self._payment_deadlines.items()))
+            if deadline > now:
+                break
+            del self._payment_deadlines[job_id]
+            if self._payment_instances.pop(job_id, None) is not None:
+                logger.info(f"Payment deadline of job {job_id} passed without payment, dropped its payment instance")
+    
+    def _payment_instance_count(self) -> int:
+        return len(self._payment_instances) + len(self._finished_payment_instances)
+    
     def get_payment_instance(self, job_id: str) -> Optional[Payment]:
         """Get the payment instance for a job."""
-        return self._payment_instances.get(job_id)
+        payment = self._payment_instances.get(job_id)
+        if payment is not None:
+            self._payment_instances.move_to_end(job_id)
+            return payment
+        return self._finished_payment_instances.get(job_id)
+    
+    def _pop_payment_instance(self, job_id: str) -> Optional[Payment]:
+        self._payment_deadlines.pop(job_id, None)
+        payment = self._payment_instances.pop(job_id, None)
+        finished = self._finished_payment_instances.pop(job_id, None)
+        return payment if payment is not None else finished
+    
+    def release_payment_instance(self, job_id: str) -> None:
+        """
+        Drop the reference to a job's payment instance without stopping its monitoring.
+        
+        Used once a job's result has been submitted: status monitoring continues
+        until on-chain confirmation without needing the job's Payment instance.
+        """
+        if self._pop_payment_instance(job_id) is not None:
+            logger.debug(f"Released payment instance for job {job_id}")
     
     async def cleanup_payment_instance(self, job_id: str) -> None:
         """Remove payment instance and stop monitoring."""
-        payment = self._payment_instances.get(job_id)
+        payment = self._pop_payment_instance(job_id)
         if payment:
             payment.stop_status_monitoring()
-            del self._payment_instances[job_id]
             logger.debug(f"Cleaned up payment instance for job {job_id}")
     
     async def list_jobs(self, status: Optional[str] = None) -> list:
@@ -2,6 +2,7 @@
 Pydantic models for MIP-003 request and response structures.
 """
 
+import secrets
 from enum import Enum
 from typing import List, Optional, Dict, Any
 from pydantic import AliasChoices, BaseModel, ConfigDict, Field
@@ -45,8 +46,7 @@ class PaymentNextAction(str, Enum):
 
 def _default_identifier() -> str:
     """Default identifier when caller (e.g. Sokosumi) omits it."""
-    import uuid
-    return f"sokosumi-{uuid.uuid4().hex[:16]}"
+    return f"sokosumi-{secrets.token_hex(8)}"
 
 
 class StartJobRequest(BaseModel):
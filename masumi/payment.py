@@ -1,17 +1,51 @@
-from dataclasses import dataclass
-from datetime import datetime, timezone, timedelta
 import asyncio
+import copy
 import logging
-import json
+import random
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal, InvalidOperation
-from typing import List, Optional, Dict, Any, Set
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
 import aiohttp
-from .config import Config
-from .helper_functions import create_masumi_input_hash, create_masumi_output_hash, setup_logging
-from .models import PaymentOnChainState, PaymentNextAction
+from multidict import CIMultiDict
+
+from .config import (
+    Config,
+    get_current_config,
+    post_json,
+    raise_if_api_key_rejected,
+    read_json,
+    read_text,
+    record_rejected_api_key,
+)
+from .helper_functions import (
+    create_masumi_input_hash,
+    create_masumi_output_hash_async,
+    setup_logging,
+)
+from .models import PaymentNextAction, PaymentOnChainState
 
 logger = setup_logging(__name__)
 
+PAY_BY_TIME_OFFSET = timedelta(hours=12)
+SUBMIT_RESULT_TIME_OFFSET = timedelta(hours=24)
+
+# On-chain states after which a payment never changes again: the funds have left the contract
+FINAL_ON_CHAIN_STATES = frozenset({
+    PaymentOnChainState.WITHDRAWN.value,
+    PaymentOnChainState.REFUND_WITHDRAWN.value,
+    PaymentOnChainState.DISPUTED_WITHDRAWN.value,
+})
+
+
+def _format_utc_timestamp(value: datetime) -> str:
+    """Format an aware UTC datetime as ISO 8601 with millisecond precision and a 'Z' suffix."""
+    return value.replace(tzinfo=None).isoformat(timespec="milliseconds") + "Z"
+
 @dataclass
 class Amount:
     """
@@ -21,6 +55,8 @@ class Amount:
         amount (int): The payment amount (e.g., 1000000 for 1 ADA)
         unit (str): The currency unit (e.g., 'lovelace' for ADA)
     """
+    __slots__ = ("amount", "unit")
+
     amount: int
     unit: str
 
@@ -40,26 +76,38 @@ class Payment:
         config (Config): Configuration for API endpoints and authentication
     """
 
+    # Upper bound on cached final payment statuses (least recently stored dropped first).
+    # Payments are also dropped from the cache by untrack_payment_id. Override in a subclass to tune.
+    FINAL_STATUS_CACHE_SIZE = 1024
+    # Upper bound on purchases whose last status response is kept for If-None-Match (LRU)
+    PURCHASE_STATUS_CACHE_SIZE = 256
+
     def __init__(self, agent_identifier: str, amounts: Optional[List[Amount]] = None, 
                  config: Config = None, network: str = "Preprod", 
                  preprod_address: Optional[str] = None,
                  mainnet_address: Optional[str] = None,
                  identifier_from_purchaser: str = "default_purchaser_id",
-                 input_data: Optional[dict] = None):
+                 input_data: Optional[Any] = None,
+                 input_hash: Optional[str] = None):
         """
         Initialize a new Payment instance.
         
         Args:
             agent_identifier (str): Unique identifier for the agent
             amounts (List[Amount], optional): DEPRECATED - Payment amounts no longer used in API
-            config (Config): Configuration object with API details
+            config (Config, optional): Configuration object with API details. Defaults to
+                the config of the current context (see masumi.config.set_current_config)
             network (str, optional): Network to use. Defaults to "PREPROD"
             preprod_address (str, optional): Custom preprod contract address
             mainnet_address (str, optional): Custom mainnet contract address
             identifier_from_purchaser (str): Identifier provided by purchaser. 
                                            Defaults to 'default_purchaser_id'
-            input_data (str, optional): Input data for hashing
+            input_data (dict or dataclass, optional): Input data for hashing
+            input_hash (str, optional): Precomputed hash of input_data (e.g. from
+                create_masumi_input_hash_async); input_data is not hashed again when given
         """
+        if config is None:
+            config = get_current_config()
         logger.info(f"Initializing Payment instance for agent {agent_identifier} on {network} network")
         self.agent_identifier = agent_identifier
         self.preprod_address = preprod_address or config.preprod_address
@@ -72,23 +120,53 @@ class Payment:
         self._logged_error_ids: Set[str] = set()  # Track payments with logged errors (separate from callbacks)
         self._logged_warning_ids: Set[str] = set()  # Track payments with logged missing-fields warning (once per payment)
         self._callback_tasks: Set[asyncio.Task] = set()  # Track callback tasks to prevent memory leaks
+        self._payment_callbacks: Dict[str, Callable] = {}  # Per-payment callbacks given to track_payment_id
         self.identifier_from_purchaser = identifier_from_purchaser
         self._status_check_task: Optional[asyncio.Task] = None
+        self._payments_added: Optional[asyncio.Event] = None  # Wakes an idle monitor (created on its loop)
+        # On-chain states that can make a payment ready for its callback; any other state is a no-op
+        self._callback_state_handlers: Dict[str, Callable[[str, Dict[str, Any]], bool]] = {
+            PaymentOnChainState.FUNDS_LOCKED.value: self._on_funds_locked,
+            PaymentOnChainState.FUNDS_OR_DATUM_INVALID.value: self._on_funds_or_datum_invalid,
+        }
+        # Status responses of payments in a FINAL_ON_CHAIN_STATES state, returned without another request
+        self._final_statuses: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Last ETag and parsed body per purchase ID, for conditional check_purchase_status requests
+        self._purchase_status_cache: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
         self.config = config
-        self._headers = {
+        # Constant per instance: endpoint URLs and the fixed part of the create-payment payload
+        self._payment_url = f"{config.payment_service_url}/payment/"
+        self._submit_result_url = f"{self._payment_url}submit-result"
+        # The payment is identified in the request body, so every status check uses this one URL
+        self._status_url = f"{self._payment_url}resolve-blockchain-identifier"
+        self._create_payload_base = {
+            "agentIdentifier": agent_identifier,
+            "network": network,
+            "paymentType": self.payment_type,
+            "identifierFromPurchaser": identifier_from_purchaser
+        }
+        # Passed as-is to aiohttp, which would otherwise copy a plain dict into a CIMultiDict per request.
+        # GETs carry no body, so they send only the token; POSTs add the JSON Content-Type.
+        self._auth_headers = CIMultiDict({"token": config.payment_api_key})
+        self._headers = CIMultiDict({
             "token": config.payment_api_key,
             "Content-Type": "application/json"
-        }
-        # Hash the input data if provided
-        self.input_hash = (
-            create_masumi_input_hash(input_data, self.identifier_from_purchaser)
-            if input_data
-            else None
-        )
-        logger.debug(f"Input data: {input_data}")
-        logger.debug(f"Input hash: {self.input_hash}")
-        #logger.debug(f"Payment amounts configured: {[f'{a.amount} {a.unit}' for a in amounts]}")
-        logger.debug(f"Using purchaser identifier: {self.identifier_from_purchaser}")
+        })
+        # Hash the input data if provided (unless the caller already did)
+        if input_hash is not None:
+            self.input_hash = input_hash
+        else:
+            self.input_hash = (
+                create_masumi_input_hash(input_data, self.identifier_from_purchaser)
+                if input_data
+                else None
+            )
+        # A Payment is built per incoming job; skip formatting the full input data unless debug is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Input data: {input_data}")
+            logger.debug(f"Input hash: {self.input_hash}")
+            #logger.debug(f"Payment amounts configured: {[f'{a.amount} {a.unit}' for a in amounts]}")
+            logger.debug(f"Using purchaser identifier: {self.identifier_from_purchaser}")
 
     @staticmethod
     def _is_zero_value(value: Any) -> bool:
@@ -139,14 +217,11 @@ class Payment:
         Create a mock payment response for free agents without hitting the payment service.
         Free agents don't need blockchain interaction or on-chain fees.
         """
-        import uuid
-
         # Generate a unique ID for tracking (not blockchain)
-        free_payment_id = f"FREE-{uuid.uuid4().hex[:24]}"
+        free_payment_id = f"FREE-{secrets.token_hex(12)}"
 
         # Set mock timestamps (not used for free agents but required by response model)
-        now = datetime.now(timezone.utc)
-        mock_time = int(now.timestamp())
+        mock_time = int(time.time())
 
         logger.info(f"Creating mock payment for free agent: {free_payment_id}")
 
@@ -194,24 +269,22 @@ class Payment:
         """
         logger.info(f"Creating new payment request for agent {self.agent_identifier}")
         
+        # Both deadlines are derived from a single clock read
+        now = datetime.now(timezone.utc)
+        
         # Set payByTime to 12 hours from now
-        pay_by_time = datetime.now(timezone.utc) + timedelta(hours=12)
-        pay_by_time_str = pay_by_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        pay_by_time_str = _format_utc_timestamp(now + PAY_BY_TIME_OFFSET)
         
         # Set submitResultTime to 24 hours from now (after payByTime)
-        submit_result_time = datetime.now(timezone.utc) + timedelta(hours=24)
-        submit_result_time_str = submit_result_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        submit_result_time_str = _format_utc_timestamp(now + SUBMIT_RESULT_TIME_OFFSET)
         
         logger.debug(f"Payment deadline (payByTime) set to {pay_by_time_str}")
         logger.debug(f"Submit result deadline set to {submit_result_time_str}")
 
         payload = {
-            "agentIdentifier": self.agent_identifier,
-            "network": self.network,
-            "paymentType": self.payment_type,
+            **self._create_payload_base,
             "payByTime": pay_by_time_str,
-            "submitResultTime": submit_result_time_str,
-            "identifierFromPurchaser": self.identifier_from_purchaser
+            "submitResultTime": submit_result_time_str
         }
 
         # Add input hash to payload if available
@@ -225,48 +298,42 @@ class Payment:
         logger.info(f"Payment request payload prepared: {payload}")
 
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                logger.debug("Sending payment request to API")
-                async with session.post(
-                    f"{self.config.payment_service_url}/payment/",
-                    headers=self._headers,
-                    json=payload
-                ) as response:
-                    if response.status == 400:
-                        error_text = await response.text()
-                        logger.error(f"Bad request error: {error_text}")
-                        raise ValueError(f"Bad request: {error_text}")
-                    if response.status == 401:
-                        logger.error("Unauthorized: Invalid API key")
-                        raise ValueError("Unauthorized: Invalid API key")
-                    if response.status == 500:
-                        logger.error("Internal server error from payment service")
-                        raise Exception("Internal server error")
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Payment request failed with status {response.status}: {error_text}")
-                        raise Exception(f"Payment request failed: {error_text}")
-                    
-                    result = await response.json()
-                    new_payment_id = result["data"]["blockchainIdentifier"]
-                    self.payment_ids.add(new_payment_id)
-                    logger.info(f"Payment request created successfully. ID: {new_payment_id}")
-                    logger.info(f"Payment Details: {json.dumps(result['data'], indent=2)}")
-                    time_values = {
-                        "payByTime": result["data"]["payByTime"],
-                        "submitResultTime": result["data"]["submitResultTime"],
-                        "unlockTime": result["data"]["unlockTime"],
-                        "externalDisputeUnlockTime": result["data"]["externalDisputeUnlockTime"]
-                    }
-                    
-                    # Add time values to the result for easy access
-                    result["time_values"] = time_values
-                    
-                    #logger.info(f"Payment request created successfully. Payment ID: {new_payment_id}")
+            logger.debug("Sending payment request to API")
+            async with post_json(self.config, self._payment_url, self._headers, payload) as response:
+                if response.status == 400:
+                    error_text = await read_text(response)
+                    logger.error(f"Bad request error: {error_text}")
+                    raise ValueError(f"Bad request: {error_text}")
+                if response.status == 401:
+                    logger.error("Unauthorized: Invalid API key")
+                    raise ValueError("Unauthorized: Invalid API key")
+                if response.status == 500:
+                    logger.error("Internal server error from payment service")
+                    raise Exception("Internal server error")
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Payment request failed with status {response.status}: {error_text}")
+                    raise Exception(f"Payment request failed: {error_text}")
+                
+                result = await read_json(response)
+                new_payment_id = result["data"]["blockchainIdentifier"]
+                self.track_payment_id(new_payment_id)
+                logger.info(f"Payment request created successfully. ID: {new_payment_id}")
+                time_values = {
+                    "payByTime": result["data"]["payByTime"],
+                    "submitResultTime": result["data"]["submitResultTime"],
+                    "unlockTime": result["data"]["unlockTime"],
+                    "externalDisputeUnlockTime": result["data"]["externalDisputeUnlockTime"]
+                }
+                
+                # Add time values to the result for easy access
+                result["time_values"] = time_values
+                
+                #logger.info(f"Payment request created successfully. Payment ID: {new_payment_id}")
+                if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Time values: {time_values}")
                     logger.debug(f"Full payment response: {result}")
-                    return result
+                return result
         except aiohttp.ClientError as e:
             logger.error(f"Network error during payment request: {str(e)}")
             raise
@@ -275,6 +342,9 @@ class Payment:
         """
         Check the status of a specific payment by blockchain identifier.
         
+        Once a payment reports a final state (see FINAL_ON_CHAIN_STATES) that response
+        is kept and returned for later checks without contacting the payment service.
+        
         Args:
             blockchain_identifier (str): The blockchain identifier of the payment to check
             
@@ -288,46 +358,55 @@ class Payment:
         if not blockchain_identifier:
             raise ValueError("blockchain_identifier cannot be empty")
         
-        logger.debug(f"Checking status for payment: {blockchain_identifier}")
+        final_status = self._final_statuses.get(blockchain_identifier)
+        if final_status is not None:
+            # A copy, so a caller modifying one result cannot change later ones
+            return copy.deepcopy(final_status)
+        
+        # Called on every poll of every tracked payment: only format debug messages when they are emitted
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"Checking status for payment: {blockchain_identifier}")
         
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                # Build request body
-                payload = {
-                    'network': self.network,
-                    'blockchainIdentifier': blockchain_identifier,
-                    'includeHistory': "false"
-                }
-                
-                url = f"{self.config.payment_service_url}/payment/resolve-blockchain-identifier"
+            # Build request body
+            payload = {
+                'network': self.network,
+                'blockchainIdentifier': blockchain_identifier,
+                'includeHistory': "false"
+            }
+            
+            url = self._status_url
+            if debug:
                 logger.debug(f"Calling payment status endpoint: {url} with payload: network={self.network}, blockchainIdentifier={blockchain_identifier[:8]}...")
-                
-                async with session.post(
-                    url,
-                    headers=self._headers,
-                    json=payload
-                ) as response:
+            
+            async with post_json(self.config, url, self._headers, payload) as response:
+                if debug:
                     logger.debug(f"Payment status check response status: {response.status} for payment {blockchain_identifier}")
-                    
-                    if response.status == 404:
-                        error_text = await response.text()
-                        logger.warning(f"Payment {blockchain_identifier} not found: {error_text}")
-                        return {
-                            "status": "error",
-                            "message": f"Payment {blockchain_identifier} not found",
-                            "data": None
-                        }
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Status check failed for payment {blockchain_identifier} with status {response.status}: {error_text}")
-                        raise Exception(f"Status check failed: {error_text}")
-                    
-                    result = await response.json()
+                
+                if response.status == 404:
+                    error_text = await read_text(response)
+                    logger.warning(f"Payment {blockchain_identifier} not found: {error_text}")
+                    return {
+                        "status": "error",
+                        "message": f"Payment {blockchain_identifier} not found",
+                        "data": None
+                    }
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Status check failed for payment {blockchain_identifier} with status {response.status}: {error_text}")
+                    raise Exception(f"Status check failed: {error_text}")
+                
+                result = await read_json(response)
+                if (result.get("data") or {}).get("onChainState") in FINAL_ON_CHAIN_STATES:
+                    self._final_statuses[blockchain_identifier] = copy.deepcopy(result)
+                    if len(self._final_statuses) > self.FINAL_STATUS_CACHE_SIZE:
+                        self._final_statuses.popitem(last=False)
+                if debug:
                     logger.debug(f"Successfully received status response for payment {blockchain_identifier}")
                     logger.debug(f"Payment {blockchain_identifier} status: {result.get('data', {}).get('onChainState', 'Unknown')}")
-                    return result
-                
+                return result
+            
         except aiohttp.ClientError as e:
             logger.error(f"Network error during status check for payment {blockchain_identifier}: {str(e)}")
             raise
@@ -352,7 +431,7 @@ class Payment:
         if not isinstance(job_output, str):
             raise TypeError("job_output must be a string")
 
-        result_hash = create_masumi_output_hash(
+        result_hash = await create_masumi_output_hash_async(
             job_output,
             self.identifier_from_purchaser
         )
@@ -364,45 +443,154 @@ class Payment:
             "submitResultHash": result_hash
         }
         
-        logger.debug(f"Payment completion payload: {payload}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Payment completion payload: {payload}")
         
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                logger.debug("Sending payment completion request to API")
-                async with session.post(
-                    f"{self.config.payment_service_url}/payment/submit-result",
-                    headers=self._headers,
-                    json=payload
-                ) as response:
-                    if response.status == 400:
-                        error_text = await response.text()
-                        logger.error(f"Bad request error: {error_text}")
-                        raise ValueError(f"Bad request: {error_text}")
-                    if response.status == 401:
-                        logger.error("Unauthorized: Invalid API key")
-                        raise ValueError("Unauthorized: Invalid API key")
-                    if response.status == 500:
-                        logger.error("Internal server error from payment service")
-                        raise Exception("Internal server error")
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Payment completion failed with status {response.status}: {error_text}")
-                        # Log the payload that failed
-                        logger.error(f"Failed payload: {payload}")
-                        raise Exception(f"Payment completion failed (status {response.status}): {error_text}")
-                    
-                    result = await response.json()
-                    logger.info(f"Payment completion request successful for {blockchain_identifier}")
+            logger.debug("Sending payment completion request to API")
+            async with post_json(self.config, self._submit_result_url, self._headers, payload) as response:
+                if response.status == 400:
+                    error_text = await read_text(response)
+                    logger.error(f"Bad request error: {error_text}")
+                    raise ValueError(f"Bad request: {error_text}")
+                if response.status == 401:
+                    logger.error("Unauthorized: Invalid API key")
+                    raise ValueError("Unauthorized: Invalid API key")
+                if response.status == 500:
+                    logger.error("Internal server error from payment service")
+                    raise Exception("Internal server error")
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Payment completion failed with status {response.status}: {error_text}")
+                    # Log the payload that failed
+                    logger.error(f"Failed payload: {payload}")
+                    raise Exception(f"Payment completion failed (status {response.status}): {error_text}")
+                
+                result = await read_json(response)
+                logger.info(f"Payment completion request successful for {blockchain_identifier}")
+                if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Payment completion response: {result}")
-                    return result
+                return result
         except aiohttp.ClientError as e:
             logger.error(f"Network error during payment completion: {str(e)}")
             raise
 
-    async def start_status_monitoring(self, callback=None, interval_seconds: int = 10) -> None:
+    def _on_funds_locked(self, payment_id: str, payment: Dict[str, Any]) -> bool:
+        """FundsLocked: always valid - payment received and locked (normal paid agents)."""
+        return True
+
+    def _on_funds_or_datum_invalid(self, payment_id: str, payment: Dict[str, Any]) -> bool:
+        """
+        FundsOrDatumInvalid: only valid for free agents (0 cost).
+        For paid agents, this state means funds/datum are genuinely invalid (wrong amount, etc.)
+        """
+        if self._is_free_payment(payment):
+            logger.info(f"Payment {payment_id[:8]}... is a free agent (0 cost), accepting FundsOrDatumInvalid state")
+            return True
+
+        # Mark as logged to prevent error log spam on subsequent checks
+        # Use separate set from callback tracking to allow state transitions
+        if not any(k in payment for k in ("price", "amount", "amounts")):
+            if payment_id not in self._logged_warning_ids:
+                logger.warning(
+                    f"Payment {payment_id[:8]}... hit FundsOrDatumInvalid but payment data "
+                    "contains no price/amount/amounts field — cannot determine if free agent. "
+                    "Treating as paid (not triggering callback)."
+                )
+                self._logged_warning_ids.add(payment_id)
+        if payment_id not in self._logged_error_ids:
+            logger.error(f"Payment {payment_id[:8]}... reached FundsOrDatumInvalid state but is NOT a free agent - this indicates invalid funds or datum. Not triggering callback.")
+            logger.error(f"Payment data: {payment}")
+            self._logged_error_ids.add(payment_id)
+        # Do not trigger callback - this is a genuine error for paid agents
+        return False
+
+    def track_payment_id(self, blockchain_identifier: str, callback: Optional[Callable] = None) -> None:
         """
-        Start monitoring payment status at regular intervals.
+        Add a payment to the set checked by status monitoring.
+
+        Wakes a running monitor immediately instead of leaving the new payment
+        until the monitor's next scheduled wake-up.
+
+        Args:
+            blockchain_identifier (str): The blockchain identifier of the payment
+            callback (Callable, optional): Called instead of the callback given to
+                start_status_monitoring when this payment becomes ready. Lets one monitor
+                serve payments that each need their own handling (e.g. one per job).
+        """
+        self.payment_ids.add(blockchain_identifier)
+        if callback is not None:
+            self._payment_callbacks[blockchain_identifier] = callback
+        if self._payments_added is not None:
+            self._payments_added.set()
+
+    def untrack_payment_id(self, blockchain_identifier: str) -> None:
+        """Stop checking a payment's status, dropping its per-payment callback and cached final status."""
+        self.payment_ids.discard(blockchain_identifier)
+        self._payment_callbacks.pop(blockchain_identifier, None)
+        self._final_statuses.pop(blockchain_identifier, None)
+        self._callback_triggered_ids.discard(blockchain_identifier)
+        self._logged_error_ids.discard(blockchain_identifier)
+        self._logged_warning_ids.discard(blockchain_identifier)
+
+    @property
+    def is_monitoring(self) -> bool:
+        """True while a status monitoring task started by start_status_monitoring is running."""
+        return self._status_check_task is not None and not self._status_check_task.done()
+
+    async def _wait_for_tracked_payments(self, timeout: Optional[float] = None) -> None:
+        """
+        Sleep until a payment is tracked via track_payment_id() or timeout elapses.
+        With timeout=None this waits for new work without waking up at all.
+        """
+        self._payments_added.clear()
+        try:
+            await asyncio.wait_for(self._payments_added.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @staticmethod
+    def _observed_state(result: Dict[str, Any]) -> tuple:
+        """The (status, onChainState, NextAction) tuple whose changes reset the poll backoff."""
+        result_data = result.get("data") or {}
+        return (
+            result.get("status"),
+            result_data.get("onChainState"),
+            (result_data.get("NextAction") or {}).get("requestedAction"),
+        )
+
+    @staticmethod
+    def _next_poll_delay(previous_delay: float, state_changed: bool,
+                         base_interval: float, max_interval: float) -> float:
+        """
+        Compute the delay before the next status check of a single payment.
+
+        The delay resets to base_interval whenever the observed state changed and
+        doubles (capped at max_interval) while the payment sits in the same state.
+        """
+        if state_changed:
+            return base_interval
+        return min(max_interval, previous_delay * 2)
+
+    @staticmethod
+    def _poll_jitter(delay: float) -> float:
+        """
+        Random offset of up to ±15% of delay, added to each scheduled status check.
+
+        Payments created together (or monitors started together) would otherwise keep
+        polling the payment service in lockstep bursts.
+        """
+        return delay * (random.random() * 0.3 - 0.15)
+
+    async def start_status_monitoring(self, callback=None, interval_seconds: int = 10,
+                                      max_interval_seconds: int = 60,
+                                      max_concurrent_checks: int = 5,
+                                      max_duration_seconds: Optional[float] = None) -> None:
+        """
+        Start monitoring payment status with exponential backoff (each check is jittered by ±15%).
+        
+        A running monitor is stopped and replaced. A monitor that already finished is
+        replaced without cancelling callbacks it started that are still running.
         
         Args:
             callback (Callable, optional): Function to call when a payment is ready to process.
@@ -417,12 +605,26 @@ class Payment:
                 If the callback fails, the payment will remain in tracking for retry on the next interval.
             interval_seconds (int, optional): Interval between status checks in seconds. 
                                              Defaults to 10.
+            max_interval_seconds (int, optional): Upper bound for the backoff. While a payment
+                stays in the same state, or its status check keeps failing, its check interval
+                doubles from interval_seconds up to this value; any state change resets it.
+                Defaults to 60.
+            max_concurrent_checks (int, optional): Maximum number of status requests in flight
+                at once when several payments are due in the same round. Defaults to 5.
+            max_duration_seconds (float, optional): Stop monitoring after this many seconds even
+                if payments are still tracked. Monitors until every payment completes if None.
         """
+        max_interval_seconds = max(max_interval_seconds, interval_seconds)
         if self._status_check_task is not None:
-            logger.warning("Status monitoring already running, stopping previous task")
-            self.stop_status_monitoring()
+            if self._status_check_task.done():
+                # Finished on its own (every payment completed): only a new task is needed.
+                # Callbacks it started may still be running and are left to finish
+                self._status_check_task = None
+            else:
+                logger.warning("Status monitoring already running, stopping previous task")
+                self.stop_status_monitoring()
         
-        logger.info(f"Starting payment status monitoring with {interval_seconds} second interval")
+        logger.info(f"Starting payment status monitoring with {interval_seconds}-{max_interval_seconds} second interval")
         
         async def monitor_task():
             """
@@ -432,37 +634,55 @@ class Payment:
             This approach:
             - Reduces network bandwidth by only fetching specific payments
             - Reduces compute/database load on payment service
-            - Allows for staggered checks to avoid burst traffic
-            - Enables per-payment interval optimization
+            - Sends due checks concurrently over the shared keep-alive session, bounded
+              by max_concurrent_checks to avoid burst traffic
+            - Enables per-payment interval optimization (exponential backoff while
+              a payment's state is unchanged, reset on every state change)
             """
             logger.info("Payment status monitoring task started (granular mode)")
             
             # Track last check time for each payment to enable staggered checking
             payment_check_times: Dict[str, float] = {}
+            # Per-payment backoff delay and last observed (status, onChainState, NextAction)
+            payment_delays: Dict[str, float] = {}
+            payment_states: Dict[str, tuple] = {}
+            check_semaphore = asyncio.Semaphore(max(1, max_concurrent_checks))
+            
+            async def fetch_status(payment_id: str) -> Dict[str, Any]:
+                async with check_semaphore:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Checking status for payment {payment_id[:8]}... using resolve-blockchain-identifier")
+                    return await self.check_payment_status_by_identifier(payment_id)
             
             while True:
                 try:
                     if not self.payment_ids:
-                        logger.debug("No payment IDs to monitor, waiting for next interval")
-                        await asyncio.sleep(interval_seconds)
+                        logger.debug("No payment IDs to monitor, waiting for a payment to be tracked")
+                        # track_payment_id() wakes this at once; the timeout still picks up
+                        # IDs added to the public payment_ids set directly
+                        await self._wait_for_tracked_payments(interval_seconds)
                         continue
                     
                     current_time = asyncio.get_event_loop().time()
                     payments_to_check = []
                     
+                    next_due_in = None
+                    
                     # Determine which payments need checking based on their last check time
-                    # Stagger checks to avoid burst traffic
                     for payment_id in list(self.payment_ids):
-                        last_check = payment_check_times.get(payment_id, 0)
-                        time_since_check = current_time - last_check
+                        last_check = payment_check_times.get(payment_id)
+                        # Never-checked payments are due now (the loop clock may be smaller than the interval)
+                        due_in = 0 if last_check is None else last_check + payment_delays.get(payment_id, interval_seconds) - current_time
                         
                         # Check if enough time has passed for this payment
-                        if time_since_check >= interval_seconds:
+                        if due_in <= 0:
                             payments_to_check.append(payment_id)
+                        elif next_due_in is None or due_in < next_due_in:
+                            next_due_in = due_in
                     
                     if not payments_to_check:
-                        # All payments were recently checked, wait a bit before next round
-                        await asyncio.sleep(min(interval_seconds, 5))
+                        # Sleep until the earliest payment is due, or a new payment is tracked
+                        await self._wait_for_tracked_payments(next_due_in)
                         continue
                     
                     logger.debug(f"Checking {len(payments_to_check)} payment(s) individually using resolve-blockchain-identifier")
@@ -471,22 +691,35 @@ class Payment:
                     successful_checks = 0
                     failed_checks = 0
                     
-                    # Check each payment individually with small stagger to avoid burst
-                    for idx, payment_id in enumerate(payments_to_check):
+                    # Fetch all due payments in one round: ~1 RTT instead of N sequential RTTs
+                    results = await asyncio.gather(
+                        *(fetch_status(payment_id) for payment_id in payments_to_check),
+                        return_exceptions=True
+                    )
+                    
+                    for payment_id, result in zip(payments_to_check, results):
                         try:
-                            # Small stagger between checks (100ms) to avoid overwhelming the service
-                            if idx > 0:
-                                await asyncio.sleep(0.1)
-                            
-                            logger.debug(f"Checking status for payment {payment_id[:8]}... using resolve-blockchain-identifier")
-                            result = await self.check_payment_status_by_identifier(payment_id)
-                            
-                            # Update last check time
+                            # Update last check time (failed requests also wait for the next interval)
                             payment_check_times[payment_id] = current_time
                             
+                            if isinstance(result, BaseException):
+                                raise result
+
+                            # Back off while the payment state is unchanged, reset on any change
+                            observed_state = self._observed_state(result)
+                            state_changed = payment_states.get(payment_id) != observed_state
+                            payment_states[payment_id] = observed_state
+                            payment_delays[payment_id] = self._next_poll_delay(
+                                payment_delays.get(payment_id, interval_seconds),
+                                state_changed,
+                                interval_seconds,
+                                max_interval_seconds,
+                            )
+                            payment_check_times[payment_id] += self._poll_jitter(payment_delays[payment_id])
+                            
                             # Handle case where payment is not found or has error status
                             if result.get("status") == "error" or not result.get("data"):
-                                logger.info(f"Payment {payment_id[:8]}... awaiting on-chain settlement (this is normal). Will check again in {interval_seconds} seconds")
+                                logger.info(f"Payment {payment_id[:8]}... awaiting on-chain settlement (this is normal). Will check again in {payment_delays[payment_id]:.0f} seconds")
                                 failed_checks += 1
                                 continue
                             
@@ -497,51 +730,26 @@ class Payment:
                             
                             # Handle case where payment exists but hasn't settled on-chain yet (onChainState is null)
                             if on_chain_state is None:
-                                logger.info(f"Payment {payment_id[:8]}... awaiting on-chain settlement (this is normal). Will check again in {interval_seconds} seconds")
+                                logger.info(f"Payment {payment_id[:8]}... awaiting on-chain settlement (this is normal). Will check again in {payment_delays[payment_id]:.0f} seconds")
                                 continue
                             
-                            logger.debug(f"Payment {payment_id[:8]}...: state={on_chain_state}, action={next_action}")
+                            if logger.isEnabledFor(logging.DEBUG):
+                                logger.debug(f"Payment {payment_id[:8]}...: state={on_chain_state}, action={next_action}")
 
                             # Determine if we should trigger the callback based on on-chain state
-                            should_trigger_callback = False
-
-                            # FundsLocked: Always valid - payment received and locked (normal paid agents)
-                            if on_chain_state == PaymentOnChainState.FUNDS_LOCKED.value:
-                                should_trigger_callback = True
-
-                            # FundsOrDatumInvalid: Only valid for free agents (0 cost)
-                            # For paid agents, this state means funds/datum are genuinely invalid (wrong amount, etc.)
-                            elif on_chain_state == PaymentOnChainState.FUNDS_OR_DATUM_INVALID.value:
-                                is_free_agent = self._is_free_payment(payment)
-
-                                if is_free_agent:
-                                    logger.info(f"Payment {payment_id[:8]}... is a free agent (0 cost), accepting FundsOrDatumInvalid state")
-                                    should_trigger_callback = True
-                                else:
-                                    # Mark as logged to prevent error log spam on subsequent checks
-                                    # Use separate set from callback tracking to allow state transitions
-                                    if not any(k in payment for k in ("price", "amount", "amounts")):
-                                        if payment_id not in self._logged_warning_ids:
-                                            logger.warning(
-                                                f"Payment {payment_id[:8]}... hit FundsOrDatumInvalid but payment data "
-                                                "contains no price/amount/amounts field — cannot determine if free agent. "
-                                                "Treating as paid (not triggering callback)."
-                                            )
-                                            self._logged_warning_ids.add(payment_id)
-                                    if payment_id not in self._logged_error_ids:
-                                        logger.error(f"Payment {payment_id[:8]}... reached FundsOrDatumInvalid state but is NOT a free agent - this indicates invalid funds or datum. Not triggering callback.")
-                                        logger.error(f"Payment data: {payment}")
-                                        self._logged_error_ids.add(payment_id)
-                                    # Do not trigger callback - this is a genuine error for paid agents
+                            state_handler = self._callback_state_handlers.get(on_chain_state)
+                            should_trigger_callback = state_handler is not None and state_handler(payment_id, payment)
 
                             # Trigger callback if valid and not already triggered
                             if should_trigger_callback and payment_id not in self._callback_triggered_ids:
                                 logger.info(f"Payment {payment_id[:8]}... reached {on_chain_state} state, triggering callback")
                                 self._callback_triggered_ids.add(payment_id)
                                 
-                                # Call the callback function if provided
-                                if callback:
-                                    async def run_callback():
+                                # Call the payment's own callback, else the monitor-wide one, if provided
+                                payment_callback = self._payment_callbacks.get(payment_id, callback)
+                                if payment_callback:
+                                    # Bind the loop variables now; the task runs after the loop moves on
+                                    async def run_callback(payment=payment, payment_id=payment_id, callback=payment_callback):
                                         """Run callback in a separate task to avoid blocking"""
                                         try:
                                             logger.info(f"Calling callback function for payment {payment_id[:8]}...")
@@ -587,8 +795,18 @@ class Payment:
                                 self._logged_error_ids.discard(payment_id)
                                 self._logged_warning_ids.discard(payment_id)
                                 payment_check_times.pop(payment_id, None)
+                                payment_delays.pop(payment_id, None)
+                                payment_states.pop(payment_id, None)
                         
                         except Exception as e:
+                            # Back off on repeated failures too, instead of retrying at a fixed rate
+                            payment_delays[payment_id] = self._next_poll_delay(
+                                payment_delays.get(payment_id, interval_seconds),
+                                False,
+                                interval_seconds,
+                                max_interval_seconds,
+                            )
+                            payment_check_times[payment_id] += self._poll_jitter(payment_delays[payment_id])
                             logger.error(f"Error checking status for payment {payment_id[:8]}...: {str(e)}")
                             failed_checks += 1
                             # Continue checking other payments even if one fails
@@ -596,7 +814,14 @@ class Payment:
                     
                     # Remove completed payments
                     for payment_id in payments_to_remove:
-                        self.payment_ids.discard(payment_id)
+                        self.untrack_payment_id(payment_id)
+                    
+                    # Forget the schedule of payments untracked from outside the loop
+                    if len(payment_check_times) > len(self.payment_ids):
+                        for payment_id in [p for p in payment_check_times if p not in self.payment_ids]:
+                            payment_check_times.pop(payment_id, None)
+                            payment_delays.pop(payment_id, None)
+                            payment_states.pop(payment_id, None)
                     
                     if successful_checks > 0 or failed_checks > 0:
                         logger.debug(f"Granular check completed: {successful_checks} successful, {failed_checks} failed, {len(self.payment_ids)} active")
@@ -606,17 +831,92 @@ class Payment:
                         logger.info("No more payments to monitor, stopping monitoring task")
                         return
                     
-                    # Short sleep before next check cycle (payments are checked individually based on their last check time)
-                    await asyncio.sleep(1)
-                    
                 except Exception as e:
-                    logger.error(f"Error during status monitoring: {str(e)}", exc_info=True)
-                    await asyncio.sleep(interval_seconds)
+                    # This repeats every interval while the cause persists; format the traceback only when debugging
+                    logger.error(f"Error during status monitoring: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
+                    # Like the idle waits: a newly tracked payment ends the pause early
+                    await self._wait_for_tracked_payments(interval_seconds)
+        
+        async def bounded_monitor_task():
+            try:
+                await asyncio.wait_for(monitor_task(), max_duration_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Payment status monitoring stopped after {max_duration_seconds} seconds with {len(self.payment_ids)} payment(s) still tracked")
         
         # Create and store the monitoring task
-        self._status_check_task = asyncio.create_task(monitor_task())
+        self._payments_added = asyncio.Event()
+        self._status_check_task = asyncio.create_task(
+            monitor_task() if max_duration_seconds is None else bounded_monitor_task()
+        )
         logger.debug("Monitoring task created and started")
 
+    async def watch_status(self, blockchain_identifier: str, interval_seconds: float = 10,
+                           max_interval_seconds: float = 60) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield a payment's data each time its state changes, until it completes.
+
+        The payment service has no push/subscription endpoint, so this polls
+        check_payment_status_by_identifier with the same backoff as
+        start_status_monitoring: the interval doubles from interval_seconds up to
+        max_interval_seconds while nothing changes and resets on every change.
+        Unchanged or not-yet-settled responses are not yielded. Iteration ends after
+        ResultSubmitted, FundsOrDatumInvalid or a NextAction of None; break out of the
+        loop to stop earlier.
+
+        Args:
+            blockchain_identifier (str): The blockchain identifier of the payment
+            interval_seconds (float, optional): Initial delay between checks. Defaults to 10.
+            max_interval_seconds (float, optional): Upper bound for the delay. Defaults to 60.
+        """
+        max_interval_seconds = max(max_interval_seconds, interval_seconds)
+        delay = interval_seconds
+        last_state = None
+        while True:
+            result = await self.check_payment_status_by_identifier(blockchain_identifier)
+            observed_state = self._observed_state(result)
+            state_changed = observed_state != last_state
+            last_state = observed_state
+
+            _, on_chain_state, next_action = observed_state
+            if state_changed and on_chain_state is not None:
+                yield result["data"]
+
+            if on_chain_state in (
+                PaymentOnChainState.RESULT_SUBMITTED.value,
+                PaymentOnChainState.FUNDS_OR_DATUM_INVALID.value,
+            ) or next_action == PaymentNextAction.NONE.value:
+                return
+
+            delay = self._next_poll_delay(delay, state_changed, interval_seconds, max_interval_seconds)
+            await asyncio.sleep(delay + self._poll_jitter(delay))
+
+    async def wait_for_status_monitoring(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until status monitoring finishes because every tracked payment completed.
+
+        Use this instead of sleeping for a fixed time after start_status_monitoring():
+        it returns as soon as the monitoring task exits, with timeout as the upper bound.
+        Timing out does not stop the monitoring.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait. Waits indefinitely if None.
+
+        Returns:
+            bool: True if monitoring finished (or was never started), False on timeout
+        """
+        task = self._status_check_task
+        if task is None:
+            return True
+        try:
+            # shield() keeps the monitoring task alive if the wait itself times out
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+        return True
+
     def stop_status_monitoring(self) -> None:
         """
         Stop the payment status monitoring.
@@ -645,26 +945,55 @@ class Payment:
             logger.debug("No monitoring task to stop")
 
     async def check_purchase_status(self, purchase_id: str) -> Dict:
-        """Check the status of a purchase request"""
+        """
+        Check the status of a purchase request.
+
+        Repeated checks send If-None-Match with the ETag of the previous response;
+        when the payment service answers 304 Not Modified a copy of the previously
+        parsed response is returned without downloading or parsing the body again.
+        """
         logger.info(f"Checking status for purchase with ID: {purchase_id}")
         
+        headers = self._auth_headers
+        cached = self._purchase_status_cache.get(purchase_id)
+        if cached is not None:
+            headers = self._auth_headers.copy()
+            headers["If-None-Match"] = cached[0]
+        
+        raise_if_api_key_rejected(self.config.payment_api_key)
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.get(
-                    f"{self.config.payment_service_url}/purchase/{purchase_id}",
-                    headers=self._headers
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Purchase status check failed: {error_text}")
-                        raise ValueError(f"Purchase status check failed: {error_text}")
-                    
-                    result = await response.json()
-                    logger.info("Purchase status check completed successfully")
-                    logger.debug(f"Purchase status response: {result}")
-                    return result
+            session = self.config.get_http_session()
+            async with session.get(
+                f"{self.config.payment_service_url}/purchase/{purchase_id}",
+                headers=headers
+            ) as response:
+                if response.status == 401:
+                    record_rejected_api_key(self.config.payment_api_key)
+                if response.status == 304 and cached is not None:
+                    logger.info("Purchase status unchanged (not modified)")
+                    self._purchase_status_cache.move_to_end(purchase_id)
+                    # A copy, so a caller modifying one result cannot change later ones
+                    return copy.deepcopy(cached[1])
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Purchase status check failed: {error_text}")
+                    raise ValueError(f"Purchase status check failed: {error_text}")
                 
+                result = await read_json(response)
+                etag = response.headers.get("ETag")
+                if etag:
+                    # Cache a copy for the same reason the 304 path returns one
+                    self._purchase_status_cache[purchase_id] = (etag, copy.deepcopy(result))
+                    self._purchase_status_cache.move_to_end(purchase_id)
+                    if len(self._purchase_status_cache) > self.PURCHASE_STATUS_CACHE_SIZE:
+                        self._purchase_status_cache.popitem(last=False)
+                else:
+                    self._purchase_status_cache.pop(purchase_id, None)
+                logger.info("Purchase status check completed successfully")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Purchase status response: {result}")
+                return result
+            
         except aiohttp.ClientError as e:
             logger.error(f"Network error during purchase status check: {str(e)}")
             raise 
@@ -688,26 +1017,49 @@ class Payment:
             "blockchainIdentifier": blockchain_identifier
         }
         
-        logger.debug(f"Authorize refund payload: {payload}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Authorize refund payload: {payload}")
         
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.post(
-                    f"{self.config.payment_service_url}/payment/authorize-refund",
-                    headers=self._headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Authorize refund failed: {error_text}")
-                        raise ValueError(f"Authorize refund failed: {error_text}")
-                    
-                    result = await response.json()
-                    logger.info("Refund authorized successfully")
+            async with post_json(self.config, f"{self.config.payment_service_url}/payment/authorize-refund", self._headers, payload) as response:
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Authorize refund failed: {error_text}")
+                    raise ValueError(f"Authorize refund failed: {error_text}")
+                
+                result = await read_json(response)
+                logger.info("Refund authorized successfully")
+                if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Authorize refund response: {result}")
-                    return result
-                    
+                return result
+                
         except aiohttp.ClientError as e:
             logger.error(f"Network error during refund authorization: {str(e)}")
             raise
+
+
+async def create_payment_requests(payments: List[Payment], metadata: Optional[str] = None,
+                                  concurrency: int = 16) -> List[Any]:
+    """
+    Create payment requests for several Payment instances concurrently.
+
+    At most `concurrency` requests are in flight at once. Payments built from the same
+    Config share its HTTP session, whose per-host connection limit
+    (Config.HTTP_CONNECTION_LIMIT_PER_HOST) also bounds the real parallelism.
+
+    Args:
+        payments (List[Payment]): The payments to create requests for
+        metadata (str, optional): Private metadata stored with every payment request
+        concurrency (int, optional): Maximum number of requests in flight. Defaults to 16.
+
+    Returns:
+        List[Any]: One entry per payment, in order: the create_payment_request() response,
+            or the exception it raised
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def create_one(payment: Payment) -> Dict[str, Any]:
+        async with semaphore:
+            return await payment.create_payment_request(metadata)
+
+    return await asyncio.gather(*(create_one(payment) for payment in payments), return_exceptions=True)
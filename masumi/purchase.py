@@ -1,7 +1,10 @@
-from typing import Dict, Optional
 import logging
+from typing import Any, Dict, Optional
+
 import aiohttp
-from .config import Config
+from multidict import CIMultiDict
+
+from .config import Config, post_json, read_json, read_text
 from .helper_functions import create_masumi_input_hash, setup_logging
 
 logger = setup_logging(__name__, level=logging.DEBUG)
@@ -24,7 +27,7 @@ class Purchase:
         identifier_from_purchaser: Optional[str] = None,
         network: str = DEFAULT_NETWORK,
         payment_type: str = DEFAULT_PAYMENT_TYPE,
-        input_data: Optional[dict] = None
+        input_data: Optional[Any] = None  # dict or dataclass instance
     ):
         self.config = config
         self.blockchain_identifier = blockchain_identifier
@@ -43,10 +46,11 @@ class Purchase:
             else None
         )
         
-        self._headers = {
+        # Passed as-is to aiohttp, which would otherwise copy a plain dict into a CIMultiDict per request
+        self._headers = CIMultiDict({
             "token": config.payment_api_key,
             "Content-Type": "application/json"
-        }
+        })
         
         logger.debug(f"Purchase initialized for agent: {agent_identifier}")
         logger.debug(f"Using blockchain identifier: {blockchain_identifier}")
@@ -79,40 +83,36 @@ class Purchase:
         
         # Add detailed logging of the complete payload
         logger.info("Purchase request payload created")
-        logger.debug(f"Full purchase request payload: {payload}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Full purchase request payload: {payload}")
         
-        # Log each field separately for easier debugging
-        logger.debug(f"identifierFromPurchaser: {payload['identifierFromPurchaser']}")
-        logger.debug(f"blockchainIdentifier: {payload['blockchainIdentifier']}")
-        logger.debug(f"network: {payload['network']}")
-        logger.debug(f"sellerVkey: {payload['sellerVkey']}")
-        logger.debug(f"paymentType: {payload['paymentType']}")
-        logger.debug(f"payByTime: {payload['payByTime']}")
-        logger.debug(f"submitResultTime: {payload['submitResultTime']}")
-        logger.debug(f"unlockTime: {payload['unlockTime']}")
-        logger.debug(f"externalDisputeUnlockTime: {payload['externalDisputeUnlockTime']}")
-        logger.debug(f"agentIdentifier: {payload['agentIdentifier']}")
-        if self.input_hash:
-            logger.debug(f"inputHash: {payload['inputHash']}")
+            # Log each field separately for easier debugging
+            logger.debug(f"identifierFromPurchaser: {payload['identifierFromPurchaser']}")
+            logger.debug(f"blockchainIdentifier: {payload['blockchainIdentifier']}")
+            logger.debug(f"network: {payload['network']}")
+            logger.debug(f"sellerVkey: {payload['sellerVkey']}")
+            logger.debug(f"paymentType: {payload['paymentType']}")
+            logger.debug(f"payByTime: {payload['payByTime']}")
+            logger.debug(f"submitResultTime: {payload['submitResultTime']}")
+            logger.debug(f"unlockTime: {payload['unlockTime']}")
+            logger.debug(f"externalDisputeUnlockTime: {payload['externalDisputeUnlockTime']}")
+            logger.debug(f"agentIdentifier: {payload['agentIdentifier']}")
+            if self.input_hash:
+                logger.debug(f"inputHash: {payload['inputHash']}")
         
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.post(
-                    f"{self.config.payment_service_url}/purchase/",
-                    headers=self._headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Purchase request failed: {error_text}")
-                        raise ValueError(f"Purchase request failed: {error_text}")
-                    
-                    result = await response.json()
-                    logger.info("Purchase request created successfully")
+            async with post_json(self.config, f"{self.config.payment_service_url}/purchase/", self._headers, payload) as response:
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Purchase request failed: {error_text}")
+                    raise ValueError(f"Purchase request failed: {error_text}")
+                
+                result = await read_json(response)
+                logger.info("Purchase request created successfully")
+                if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Purchase response: {result}")
-                    return result
-                    
+                return result
+                
         except aiohttp.ClientError as e:
             logger.error(f"Network error during purchase request: {str(e)}")
             raise
@@ -126,26 +126,22 @@ class Purchase:
             "blockchainIdentifier": self.blockchain_identifier
         }
         
-        logger.debug(f"Refund request payload: {payload}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Refund request payload: {payload}")
         
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.post(
-                    f"{self.config.payment_service_url}/purchase/request-refund",
-                    headers=self._headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Refund request failed: {error_text}")
-                        raise ValueError(f"Refund request failed: {error_text}")
-                    
-                    result = await response.json()
-                    logger.info("Refund requested successfully")
+            async with post_json(self.config, f"{self.config.payment_service_url}/purchase/request-refund", self._headers, payload) as response:
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Refund request failed: {error_text}")
+                    raise ValueError(f"Refund request failed: {error_text}")
+                
+                result = await read_json(response)
+                logger.info("Refund requested successfully")
+                if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Refund response: {result}")
-                    return result
-                    
+                return result
+                
         except aiohttp.ClientError as e:
             logger.error(f"Network error during refund request: {str(e)}")
             raise
@@ -159,26 +155,22 @@ class Purchase:
             "blockchainIdentifier": self.blockchain_identifier
         }
         
-        logger.debug(f"Cancel refund payload: {payload}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Cancel refund payload: {payload}")
         
         try:
-            connector = aiohttp.TCPConnector()
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.post(
-                    f"{self.config.payment_service_url}/purchase/cancel-refund-request",
-                    headers=self._headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Cancel refund request failed: {error_text}")
-                        raise ValueError(f"Cancel refund request failed: {error_text}")
-                    
-                    result = await response.json()
-                    logger.info("Refund request cancelled successfully")
+            async with post_json(self.config, f"{self.config.payment_service_url}/purchase/cancel-refund-request", self._headers, payload) as response:
+                if response.status != 200:
+                    error_text = await read_text(response)
+                    logger.error(f"Cancel refund request failed: {error_text}")
+                    raise ValueError(f"Cancel refund request failed: {error_text}")
+                
+                result = await read_json(response)
+                logger.info("Refund request cancelled successfully")
+                if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Cancel refund response: {result}")
-                    return result
-                    
+                return result
+                
         except aiohttp.ClientError as e:
             logger.error(f"Network error during cancel refund request: {str(e)}")
             raise
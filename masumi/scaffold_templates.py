@@ -3,7 +3,6 @@ Templates for generating Masumi agent projects with full project structure.
 """
 
 import os
-import time
 from typing import Optional, List, Dict
 from pathlib import Path
 
@@ -476,7 +475,6 @@ def scaffold(
                 (project_path / ".gitignore").write_text(_get_gitignore_template())
                 from .interactive_cli import print_success
                 print_success(success_msg)
-            time.sleep(0.05)
     else:
         # Non-interactive mode - just write files
         (project_path / "agent.py").write_text(agent_template)
@@ -12,7 +12,7 @@ from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 
-from .config import Config
+from .config import Config, load_env_file, set_current_config
 from .payment import Payment
 from .models import (
     StartJobRequest,
@@ -27,7 +27,7 @@ from .models import (
 from .endpoints import AgentEndpointHandler
 from .job_manager import JobManager, JobStorage, InMemoryJobStorage
 from .validation import validate_input_data, ValidationError
-from .helper_functions import setup_logging, create_masumi_input_hash, check_free_agent_from_registry
+from .helper_functions import setup_logging, create_masumi_input_hash_async, check_free_agent_from_registry
 from .models import JobStatus
 from .hitl import set_job_context, clear_job_context, provide_input_to_job
 
@@ -79,6 +79,9 @@ class MasumiAgentServer:
         """
         import os
         
+        if not agent_identifier or not seller_vkey:
+            load_env_file()
+        
         # Load agent_identifier from environment if not provided
         if not agent_identifier:
             agent_identifier = os.getenv("AGENT_IDENTIFIER")
@@ -110,6 +113,9 @@ class MasumiAgentServer:
         # Track background tasks to prevent memory leaks
         self._background_tasks: Set[asyncio.Task] = set()
         
+        # Single status monitor shared by all jobs (created on the first paid job)
+        self._payment_monitor: Optional[Payment] = None
+        
         # Initialize job manager with storage
         storage = job_storage or InMemoryJobStorage()
         self.job_manager = JobManager(storage)
@@ -142,6 +148,7 @@ class MasumiAgentServer:
         @self.app.on_event("shutdown")
         async def shutdown_handler():
             await self.cleanup_background_tasks()
+            await self.config.close()
 
         # Log 422 validation errors for debugging (e.g. Sokosumi request format)
         @self.app.exception_handler(RequestValidationError)
@@ -199,12 +206,21 @@ class MasumiAgentServer:
                     )
 
                 # Check if this is a free agent by querying the registry
-                is_free_agent = await check_free_agent_from_registry(
+                registry_check = check_free_agent_from_registry(
                     agent_identifier=self.agent_identifier,
                     payment_service_url=self.config.payment_service_url,
                     payment_api_key=self.config.payment_api_key,
-                    network=self.network
+                    network=self.network,
+                    http_session=self.config.get_http_session()
                 )
+                if request.input_data:
+                    # Hash the input in a worker thread while the registry request is in flight
+                    is_free_agent, input_hash = await asyncio.gather(
+                        registry_check,
+                        create_masumi_input_hash_async(request.input_data, request.identifier_from_purchaser)
+                    )
+                else:
+                    is_free_agent, input_hash = await registry_check, None
 
                 # Validate seller_vkey for paid agents
                 if not is_free_agent and not self.seller_vkey:
@@ -219,6 +235,7 @@ class MasumiAgentServer:
                     config=self.config,
                     identifier_from_purchaser=request.identifier_from_purchaser,
                     input_data=request.input_data,
+                    input_hash=input_hash,
                     network=self.network
                 )
 
@@ -231,7 +248,6 @@ class MasumiAgentServer:
                     logger.info("Creating payment request...")
                     payment_request = await payment.create_payment_request()
                     blockchain_identifier = payment_request["data"]["blockchainIdentifier"]
-                    payment.payment_ids.add(blockchain_identifier)
                 
                 # Get seller vkey (use provided or from env/config)
                 seller_vkey = self.seller_vkey or payment_request["data"].get("sellerVKey", "")
@@ -265,9 +281,10 @@ class MasumiAgentServer:
                         payment_id = payment.get("blockchainIdentifier", "")
                         await self._handle_payment_confirmed(job_id, payment_id)
 
-                    # Start monitoring payment
+                    # Monitor the payment on the server-wide monitor, which checks all
+                    # pending payments in one loop instead of one task per job
                     logger.info(f"Starting payment monitoring for job {job_id}")
-                    await payment.start_status_monitoring(callback=payment_callback)
+                    await self._monitor_payment(blockchain_identifier, payment_callback)
                 
                 # Return response
                 return StartJobResponse(
@@ -407,7 +424,7 @@ class MasumiAgentServer:
                 
                 # Calculate input_hash for the provided input_data
                 identifier_from_purchaser = job.get("identifier_from_purchaser", "")
-                input_hash = create_masumi_input_hash(request.input_data, identifier_from_purchaser)
+                input_hash = await create_masumi_input_hash_async(request.input_data, identifier_from_purchaser)
                 
                 # Return response with input_hash and signature (signature is empty for now)
                 return ProvideInputResponse(
@@ -458,7 +475,7 @@ class MasumiAgentServer:
             logger.error(f"Error starting agent logic for job {job_id}: {e}", exc_info=True)
             try:
                 await self.job_manager.set_job_failed(job_id, str(e))
-                await self.job_manager.cleanup_payment_instance(job_id)
+                await self._cleanup_job_payment(job_id)
             except Exception as cleanup_error:
                 logger.error(f"Error during cleanup: {cleanup_error}", exc_info=True)
 
@@ -478,15 +495,17 @@ class MasumiAgentServer:
             if not start_handler:
                 logger.error(f"Start job handler not configured for job {job_id}")
                 await self.job_manager.set_job_failed(job_id, "Start job handler not configured")
-                await self.job_manager.cleanup_payment_instance(job_id)
+                await self._cleanup_job_payment(job_id)
                 return
             
             # Execute agent logic
             input_data = job.get("input_data", {})
             identifier_from_purchaser = job.get("identifier_from_purchaser", "")
             
-            # Set job context for HITL functionality
+            # Set job context for HITL functionality, and this server's config for any
+            # Payment the agent logic creates without passing config=
             set_job_context(job_id, self.job_manager)
+            set_current_config(self.config)
             try:
                 try:
                     # We await the handler. If it's a long-running but properly async function,
@@ -497,10 +516,11 @@ class MasumiAgentServer:
                 finally:
                     # Always clear the context after execution
                     clear_job_context()
+                    set_current_config(None)
             except Exception as e:
                 logger.error(f"Error executing agent logic for job {job_id}: {e}", exc_info=True)
                 await self.job_manager.set_job_failed(job_id, str(e))
-                await self.job_manager.cleanup_payment_instance(job_id)
+                await self._cleanup_job_payment(job_id)
                 return
             
             # Ensure result is a string for on-chain hashing
@@ -513,7 +533,7 @@ class MasumiAgentServer:
                     error_msg = f"Failed to serialize agent result: {str(e)}"
                     logger.error(f"Invalid result for job {job_id}: {error_msg}")
                     await self.job_manager.set_job_failed(job_id, error_msg)
-                    await self.job_manager.cleanup_payment_instance(job_id)
+                    await self._cleanup_job_payment(job_id)
                     return
             
             # Update job status to completed (now also handles on-chain submission)
@@ -524,23 +544,26 @@ class MasumiAgentServer:
                 logger.error(f"Error completing job {job_id}: {e}", exc_info=True)
                 await self.job_manager.set_job_failed(job_id, f"Job completion failed: {str(e)}")
                 # We cleanup on failure because we won't be reaching a 'Complete' state normally
-                await self.job_manager.cleanup_payment_instance(job_id)
+                await self._cleanup_job_payment(job_id)
                 return
             
             # Free agents never start payment monitoring, so we must cleanup here.
             # Paid agents: monitoring task runs until on-chain confirmation; no cleanup needed here.
             payment_id = job.get("payment_id", "")
             if payment_id.startswith("FREE-"):
-                await self.job_manager.cleanup_payment_instance(job_id)
+                await self._cleanup_job_payment(job_id)
                 logger.info(f"Free agent job {job_id} finished; payment instance cleaned up.")
             else:
+                # The server-wide monitor keeps checking the payment until on-chain
+                # confirmation; the job's own Payment is no longer needed.
+                self.job_manager.release_payment_instance(job_id)
                 logger.info(f"Job {job_id} logic finished. Monitoring will continue until on-chain confirmation.")
             
         except Exception as e:
             logger.error(f"Fatal error in _execute_agent_job for job {job_id}: {e}", exc_info=True)
             try:
                 await self.job_manager.set_job_failed(job_id, str(e))
-                await self.job_manager.cleanup_payment_instance(job_id)
+                await self._cleanup_job_payment(job_id)
             except Exception as cleanup_error:
                 logger.error(f"Error during final cleanup: {cleanup_error}", exc_info=True)
     
@@ -572,7 +595,8 @@ class MasumiAgentServer:
         # Validate input against schema if available
         input_schema = job.get("awaiting_input_schema")
         if input_schema:
-            logger.debug(f"Validating input_data for job {job_id}: {input_data} against schema: {input_schema}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Validating input_data for job {job_id}: {input_data} against schema: {input_schema}")
             try:
                 validate_input_data(input_data, input_schema)
             except ValidationError as e:
@@ -606,19 +630,46 @@ class MasumiAgentServer:
         
         logger.info(f"Input provided for job {job_id}, resuming execution")
     
+    def _get_payment_monitor(self) -> Payment:
+        """Return the Payment whose status monitoring task watches every job's payment."""
+        if self._payment_monitor is None:
+            self._payment_monitor = Payment(
+                agent_identifier=self.agent_identifier,
+                config=self.config,
+                network=self.network
+            )
+        return self._payment_monitor
+
+    async def _monitor_payment(self, blockchain_identifier: str,
+                               callback: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """Track a job's payment on the shared monitor, starting the monitor if it is not running."""
+        monitor = self._get_payment_monitor()
+        monitor.track_payment_id(blockchain_identifier, callback=callback)
+        if not monitor.is_monitoring:
+            await monitor.start_status_monitoring()
+
+    async def _cleanup_job_payment(self, job_id: str) -> None:
+        """Drop a job's Payment instance and stop monitoring its payment (e.g. after the job failed)."""
+        await self.job_manager.cleanup_payment_instance(job_id)
+        if self._payment_monitor is not None:
+            job = await self.job_manager.get_job(job_id)
+            if job and job.get("payment_id"):
+                self._payment_monitor.untrack_payment_id(job["payment_id"])
+
     async def cleanup_background_tasks(self):
         """Cancel all background tasks to prevent memory leaks on shutdown."""
+        if self._payment_monitor is not None:
+            self._payment_monitor.stop_status_monitoring()
         if self._background_tasks:
             logger.info(f"Cancelling {len(self._background_tasks)} background tasks")
-            for task in self._background_tasks.copy():
-                if not task.done():
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
-                    except Exception as e:
-                        logger.warning(f"Error cancelling background task: {e}")
+            pending = [task for task in self._background_tasks.copy() if not task.done()]
+            for task in pending:
+                task.cancel()
+            # Wait for all cancellations together instead of one task at a time
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):  # CancelledError is a BaseException
+                    logger.warning(f"Error cancelling background task: {result}")
             self._background_tasks.clear()
             logger.info("All background tasks cleaned up")
     
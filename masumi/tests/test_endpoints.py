@@ -2,19 +2,21 @@
 Tests for endpoint handlers, validation, and FastAPI integration.
 """
 
+import asyncio
 import os
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
 import pytest
-import asyncio
-from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
 
+from masumi.config import Config
 from masumi.endpoints import AgentEndpointHandler
+from masumi.job_manager import InMemoryJobStorage, JobManager
 from masumi.models import StartJobRequest
-from masumi.validation import validate_input_data, ValidationError
-from masumi.job_manager import JobManager, InMemoryJobStorage
-from masumi.config import Config
 from masumi.payment import Payment
 from masumi.server import create_masumi_app
+from masumi.validation import ValidationError, validate_input_data
 
 
 @pytest.fixture
@@ -26,12 +28,57 @@ def mock_config():
     )
 
 
+@pytest.fixture
+def free_agent_config(mock_config):
+    """The mock config with free_agent=True (registry marks the agent as free)."""
+    return Config(
+        payment_service_url=mock_config.payment_service_url,
+        payment_api_key=mock_config.payment_api_key,
+        free_agent=True,
+    )
+
+
 @pytest.fixture
 def endpoint_handler():
     """Create an endpoint handler for testing."""
     return AgentEndpointHandler()
 
 
+@pytest.fixture
+def isolated_process_state():
+    """Reset process-wide caches and the context config around a test, so tests don't depend on order."""
+    from masumi.config import (
+        _rejected_api_keys,
+        get_config_from_env,
+        load_env_file,
+        set_current_config,
+    )
+    from masumi.helper_functions import _registry_env_defaults
+
+    def reset():
+        _rejected_api_keys.clear()
+        get_config_from_env.cache_clear()
+        load_env_file.cache_clear()
+        _registry_env_defaults.cache_clear()
+        set_current_config(None)
+
+    reset()
+    yield
+    reset()
+
+
+async def wait_until(predicate, *, timeout=2.0, initial=0.001, factor=1.5, cap=0.05):
+    """Return as soon as predicate() holds, polling with capped exponential backoff."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = initial
+    while not predicate():
+        if loop.time() >= deadline:
+            raise AssertionError(f"Condition not met within {timeout} seconds")
+        await asyncio.sleep(delay)
+        delay = min(delay * factor, cap)
+
+
 @pytest.mark.asyncio
 async def test_start_job_handler_registration(endpoint_handler):
     """Test registering a start_job handler."""
@@ -314,6 +361,8 @@ def test_in_memory_job_storage():
 def test_job_manager(mock_config):
     """Test JobManager."""
     manager = JobManager()
+    # The fake payment host is unreachable; keep the result-submission retries short
+    manager.RESULT_SUBMIT_RETRY_DELAY = 0.01
     
     # Create a real Payment instance instead of a mock
     payment = Payment(
@@ -330,7 +379,7 @@ def test_job_manager(mock_config):
         input_data={"text": "test"},
         payment=payment,
         blockchain_identifier="blockchain-123",
-        pay_by_time=1234567890,
+        pay_by_time=int((time.time() + 3600) * 1000),
         submit_result_time=1234567900,
         unlock_time=1234568000,
         external_dispute_unlock_time=1234569000,
@@ -437,16 +486,10 @@ async def test_create_free_agent_mock_payment_returns_off_chain_shape(mock_confi
 
 
 @pytest.mark.asyncio
-async def test_free_agent_start_job_does_not_call_payment_service(mock_config):
+async def test_free_agent_start_job_does_not_call_payment_service(free_agent_config):
     """With config.free_agent=True, /start_job must not call payment service or start_status_monitoring."""
     job_executed = []
 
-    free_agent_config = Config(
-        payment_service_url=mock_config.payment_service_url,
-        payment_api_key=mock_config.payment_api_key,
-        free_agent=True,
-    )
-
     @patch.object(Payment, "create_payment_request", new_callable=AsyncMock)
     @patch.object(Payment, "start_status_monitoring", new_callable=AsyncMock)
     async def _run(create_mock, monitor_mock):
@@ -483,14 +526,8 @@ async def test_free_agent_start_job_does_not_call_payment_service(mock_config):
 
 
 @pytest.mark.asyncio
-async def test_free_agent_job_executes_immediately(mock_config):
+async def test_free_agent_job_executes_immediately(free_agent_config):
     """Free agent returns 200 with FREE- id; job is scheduled off-chain (no payment wait)."""
-    free_agent_config = Config(
-        payment_service_url=mock_config.payment_service_url,
-        payment_api_key=mock_config.payment_api_key,
-        free_agent=True,
-    )
-
     async def _run():
         async def start_job_handler(identifier: str, input_data: dict):
             return {"result": "free-agent-result"}
@@ -554,3 +591,1281 @@ async def test_endpoint_handler_all_handlers(endpoint_handler):
     assert endpoint_handler.get_input_schema() is not None
     assert endpoint_handler.get_provide_input_handler() is not None
     assert endpoint_handler.get_demo_handler() is not None
+
+
+@pytest.mark.asyncio
+async def test_config_reuses_http_session(mock_config):
+    """Payment/Purchase calls share one keep-alive session per config and event loop."""
+    session = mock_config.get_http_session()
+    assert mock_config.get_http_session() is session
+    assert session.connector.limit_per_host == Config.HTTP_CONNECTION_LIMIT_PER_HOST
+
+    await mock_config.close()
+    assert session.closed
+
+    # A fresh session is created lazily after close
+    new_session = mock_config.get_http_session()
+    assert new_session is not session
+    await mock_config.close()
+
+
+def test_config_releases_session_of_finished_event_loop(mock_config):
+    """A session left behind by an earlier event loop is closed when the config replaces it."""
+    async def get_session():
+        return mock_config.get_http_session()
+
+    async def get_session_and_close():
+        session = mock_config.get_http_session()
+        await mock_config.close()
+        return session
+
+    old = asyncio.run(get_session())
+    new = asyncio.run(get_session_and_close())
+
+    assert new is not old
+    assert old.closed
+    assert new.closed
+
+
+@pytest.mark.asyncio
+async def test_config_leaves_caller_session_open():
+    """A session supplied by the caller is used as-is and not closed by the config."""
+    import aiohttp
+
+    async with aiohttp.ClientSession() as external_session:
+        config = Config(
+            payment_service_url="https://test.payment.masumi.network/api/v1",
+            payment_api_key="test_api_key",
+            http_session=external_session,
+        )
+        assert config.get_http_session() is external_session
+        await config.close()
+        assert not external_session.closed
+
+
+def test_payment_poll_delay_backoff():
+    """Status polling backs off while a payment is unchanged and resets on a state change."""
+    delay = 10
+    delays = []
+    for _ in range(4):
+        delay = Payment._next_poll_delay(delay, False, 10, 60)
+        delays.append(delay)
+    assert delays == [20, 40, 60, 60]
+
+    assert Payment._next_poll_delay(60, True, 10, 60) == 10
+
+
+def test_output_hash_is_computed_and_logged_every_time():
+    """Output hashes are not cached: each call hashes (and logs) again, keeping no outputs alive."""
+    from masumi.helper_functions import create_masumi_output_hash
+
+    with patch("masumi.helper_functions.logger.info") as info:
+        first = create_masumi_output_hash("result \"text\"\n", "purchaser-1")
+        second = create_masumi_output_hash("result \"text\"\n", "purchaser-1")
+    assert first == second
+    generated = [c for c in info.call_args_list if "Generated Output Hash" in c.args[0]]
+    assert len(generated) == 2
+
+    # Different purchaser must produce a different hash
+    assert create_masumi_output_hash("result \"text\"\n", "purchaser-2") != first
+
+
+@pytest.mark.asyncio
+async def test_cleanup_background_tasks_cancels_all(mock_config):
+    """Shutdown cancels every pending background task and clears the tracking set."""
+    from masumi.server import MasumiAgentServer
+
+    server = MasumiAgentServer(config=mock_config, agent_identifier="agent-123", seller_vkey="vkey")
+    tasks = [asyncio.create_task(asyncio.sleep(3600)) for _ in range(3)]
+    server._background_tasks.update(tasks)
+
+    await server.cleanup_background_tasks()
+
+    assert all(task.cancelled() for task in tasks)
+    assert not server._background_tasks
+
+
+@pytest.mark.asyncio
+async def test_job_manager_bounds_payment_instances(mock_config):
+    """JobManager evicts finished jobs' payment instances beyond the limit, never live ones."""
+    manager = JobManager(max_payment_instances=2)
+    job_ids = ("job-1", "job-2", "job-3", "job-4")
+    payments = {
+        job_id: Payment(agent_identifier="agent-123", config=mock_config)
+        for job_id in job_ids
+    }
+    for job_id in job_ids:
+        await manager.storage.create_job(job_id, {"job_id": job_id, "status": "running"})
+    pay_by_time_ms = int((time.time() + 3600) * 1000)
+
+    manager._track_payment_instance("job-1", payments["job-1"], pay_by_time_ms)
+    manager._track_payment_instance("job-2", payments["job-2"], pay_by_time_ms)
+    # Live jobs stay tracked even beyond the limit, with a single warning
+    with patch("masumi.job_manager.logger.warning") as warning:
+        manager._track_payment_instance("job-3", payments["job-3"], pay_by_time_ms)
+        manager._track_payment_instance("job-3", payments["job-3"], pay_by_time_ms)
+    assert warning.call_count == 1
+    assert all(manager.get_payment_instance(j) is payments[j] for j in job_ids[:3])
+
+    await manager.set_job_failed("job-2", "boom")
+    await manager.set_job_failed("job-1", "boom")
+    manager._track_payment_instance("job-4", payments["job-4"], pay_by_time_ms)
+
+    # Finished jobs are evicted oldest-finished first, down to the limit
+    assert manager.get_payment_instance("job-2") is None
+    assert manager.get_payment_instance("job-1") is None
+    assert manager.get_payment_instance("job-3") is payments["job-3"]
+    assert manager.get_payment_instance("job-4") is payments["job-4"]
+
+    manager.release_payment_instance("job-3")
+    assert manager.get_payment_instance("job-3") is None
+
+
+@pytest.mark.asyncio
+async def test_job_manager_expires_unpaid_jobs_after_pay_by_time(mock_config):
+    """Jobs still awaiting payment after payByTime (plus grace) lose their payment instance; paid ones keep it."""
+    manager = JobManager()
+    payments = {job_id: Payment(agent_identifier="agent-123", config=mock_config) for job_id in ("a", "b", "c")}
+    for job_id in payments:
+        await manager.storage.create_job(job_id, {"job_id": job_id, "status": "awaiting_payment"})
+    now = time.time()
+    pay_by_time_ms = int(now * 1000)
+
+    manager._track_payment_instance("a", payments["a"], pay_by_time_ms)
+    manager._track_payment_instance("b", payments["b"], pay_by_time_ms)
+    await manager.set_job_running("b")  # paid before its deadline
+    # Still within the grace period after payByTime: nothing expires yet
+    manager._track_payment_instance("c", payments["c"], pay_by_time_ms + 10_000_000)
+    assert manager.get_payment_instance("a") is payments["a"]
+
+    with patch("masumi.job_manager.time.time", return_value=now + JobManager.PAYMENT_DEADLINE_GRACE_SECONDS + 1):
+        manager._track_payment_instance("c", payments["c"], pay_by_time_ms + 10_000_000)
+
+    assert manager.get_payment_instance("a") is None
+    assert manager.get_payment_instance("b") is payments["b"]
+    assert manager.get_payment_instance("c") is payments["c"]
+
+
+def test_job_manager_never_completes_paid_job_without_payment_instance():
+    """A paid job whose Payment is gone fails loudly instead of completing without submission."""
+    manager = JobManager()
+    asyncio.run(manager.storage.create_job(
+        "job-1", {"job_id": "job-1", "status": "running", "payment_id": "blockchain-123", "result": None}
+    ))
+
+    with pytest.raises(ValueError, match="not submitted"):
+        asyncio.run(manager.set_job_completed("job-1", "result"))
+
+    job = asyncio.run(manager.get_job("job-1"))
+    assert job["status"] == "running"
+    assert job["result"] is None
+
+
+def test_format_utc_timestamp_matches_payment_api_format():
+    """Deadlines are sent as ISO 8601 UTC with millisecond precision and a Z suffix."""
+    from datetime import datetime, timezone
+
+    from masumi.payment import _format_utc_timestamp
+
+    value = datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=timezone.utc)
+    assert _format_utc_timestamp(value) == "2024-05-06T07:08:09.123Z"
+    assert _format_utc_timestamp(value.replace(microsecond=0)) == "2024-05-06T07:08:09.000Z"
+
+
+@pytest.mark.asyncio
+async def test_output_hash_async_matches_sync():
+    """The async output hash (offloaded for large outputs) equals the synchronous hash."""
+    from masumi.helper_functions import (
+        OUTPUT_HASH_OFFLOAD_THRESHOLD,
+        create_masumi_output_hash,
+        create_masumi_output_hash_async,
+    )
+
+    small = "short result"
+    large = "x\n" * OUTPUT_HASH_OFFLOAD_THRESHOLD
+    for output in (small, large):
+        assert await create_masumi_output_hash_async(output, "purchaser-1") == \
+            create_masumi_output_hash(output, "purchaser-1")
+
+
+def test_get_config_from_env_is_cached(monkeypatch, isolated_process_state):
+    """The environment-derived Config is built once per process and reused."""
+    from masumi.config import DEFAULT_PAYMENT_SERVICE_URL, get_config_from_env
+
+    monkeypatch.delenv("PAYMENT_SERVICE_URL", raising=False)
+    monkeypatch.setenv("PAYMENT_API_KEY", "env_api_key")
+    config = get_config_from_env()
+    assert config.payment_service_url == DEFAULT_PAYMENT_SERVICE_URL
+    assert config.payment_api_key == "env_api_key"
+    assert get_config_from_env() is config
+
+
+@pytest.mark.asyncio
+async def test_wait_for_status_monitoring_returns_when_complete(mock_config):
+    """Waiting on monitoring resolves as soon as the last payment completes, not after the timeout."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    assert await payment.wait_for_status_monitoring(timeout=0.1) is True  # never started
+
+    payment.payment_ids.add("payment-123")
+    submitted = {"status": "success", "data": {"onChainState": "ResultSubmitted"}}
+    with patch.object(Payment, "check_payment_status_by_identifier", new=AsyncMock(return_value=submitted)):
+        await payment.start_status_monitoring(interval_seconds=1)
+        assert await payment.wait_for_status_monitoring(timeout=5) is True
+
+    assert not payment.payment_ids
+
+
+@pytest.mark.asyncio
+async def test_status_monitoring_checks_due_payments_concurrently(mock_config):
+    """Due payments are fetched in one concurrent round and each callback gets its own payment."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    payment_ids = {"payment-a", "payment-b", "payment-c"}
+    payment.payment_ids.update(payment_ids)
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_status(blockchain_identifier):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return {"status": "success", "data": {
+            "blockchainIdentifier": blockchain_identifier,
+            "onChainState": "FundsLocked",
+            "NextAction": {"requestedAction": "None"},
+        }}
+
+    received = []
+
+    async def callback(payment_data):
+        received.append(payment_data["blockchainIdentifier"])
+
+    with patch.object(Payment, "check_payment_status_by_identifier", new=AsyncMock(side_effect=fake_status)):
+        await payment.start_status_monitoring(callback=callback, interval_seconds=1, max_concurrent_checks=2)
+        assert await payment.wait_for_status_monitoring(timeout=5) is True
+        await wait_until(lambda: len(received) == len(payment_ids))  # callbacks run in their own tasks
+
+    assert max_in_flight == 2
+    assert sorted(received) == sorted(payment_ids)
+
+
+def test_input_hash_accepts_dataclass_input():
+    """Dataclass input types hash exactly like the equivalent dict."""
+    from dataclasses import dataclass
+
+    from masumi.helper_functions import create_masumi_input_hash
+
+    @dataclass(frozen=True)
+    class TextInput:
+        __slots__ = ("text", "language")
+        text: str
+        language: str
+
+    as_dataclass = create_masumi_input_hash(TextInput("hello", "en"), "purchaser-1")
+    as_dict = create_masumi_input_hash({"text": "hello", "language": "en"}, "purchaser-1")
+    assert as_dataclass == as_dict
+
+
+@pytest.mark.asyncio
+async def test_idle_status_monitoring_wakes_on_tracked_payment(mock_config):
+    """An idle monitor picks up a newly tracked payment at once instead of after interval_seconds."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    submitted = {"status": "success", "data": {"onChainState": "ResultSubmitted"}}
+    status_mock = AsyncMock(return_value=submitted)
+
+    with patch.object(Payment, "check_payment_status_by_identifier", new=status_mock):
+        await payment.start_status_monitoring(interval_seconds=60)
+        await asyncio.sleep(0)  # one loop turn: the monitor runs until it parks on the event
+        status_mock.assert_not_called()
+
+        payment.track_payment_id("payment-123")
+        assert await payment.wait_for_status_monitoring(timeout=1) is True
+
+    status_mock.assert_awaited_once_with("payment-123")
+
+
+@pytest.mark.asyncio
+async def test_idle_status_monitoring_polls_ids_added_to_payment_ids(mock_config):
+    """IDs added to the public payment_ids set directly are still picked up within interval_seconds."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    submitted = {"status": "success", "data": {"onChainState": "ResultSubmitted"}}
+    status_mock = AsyncMock(return_value=submitted)
+
+    with patch.object(Payment, "check_payment_status_by_identifier", new=status_mock):
+        await payment.start_status_monitoring(interval_seconds=0.01)
+        await asyncio.sleep(0)
+        payment.payment_ids.add("payment-123")
+        assert await payment.wait_for_status_monitoring(timeout=1) is True
+
+    status_mock.assert_awaited_once_with("payment-123")
+
+
+def test_json_codec_round_trips_payment_payloads():
+    """The payment service JSON codec round-trips request and response bodies."""
+    from masumi.config import json_dumps, json_loads
+
+    payload = {"identifierFromPurchaser": "purchaser-1", "metadata": "ü", "amounts": [{"amount": "1000000"}]}
+    encoded = json_dumps(payload)
+    assert isinstance(encoded, str)
+    assert json_loads(encoded) == payload
+
+
+def test_payment_init_skips_input_debug_formatting(mock_config):
+    """Constructing a Payment per job does not render input_data when debug logging is off."""
+    import logging
+
+    class CountingDict(dict):
+        repr_calls = 0
+
+        def __repr__(self):
+            CountingDict.repr_calls += 1
+            return super().__repr__()
+
+    payment_logger = logging.getLogger("masumi.payment")
+    previous_level = payment_logger.level
+    payment_logger.setLevel(logging.INFO)
+    try:
+        payment = Payment(agent_identifier="agent-123", config=mock_config,
+                          input_data=CountingDict(text="hello"))
+    finally:
+        payment_logger.setLevel(previous_level)
+
+    assert payment.input_hash is not None
+    assert CountingDict.repr_calls == 0
+
+
+@pytest.mark.asyncio
+async def test_precomputed_input_hash_is_reused(mock_config):
+    """A hash computed off the loop matches the sync one and Payment does not recompute it."""
+    from masumi.helper_functions import (
+        create_masumi_input_hash,
+        create_masumi_input_hash_async,
+    )
+
+    input_data = {"text": "hello"}
+    input_hash = await create_masumi_input_hash_async(input_data, "purchaser-1")
+    assert input_hash == create_masumi_input_hash(input_data, "purchaser-1")
+
+    with patch("masumi.payment.create_masumi_input_hash") as hash_mock:
+        payment = Payment(agent_identifier="agent-123", config=mock_config,
+                          identifier_from_purchaser="purchaser-1",
+                          input_data=input_data, input_hash=input_hash)
+    hash_mock.assert_not_called()
+    assert payment.input_hash == input_hash
+
+
+def test_callback_state_handlers(mock_config):
+    """Only FundsLocked and free-agent FundsOrDatumInvalid make a payment ready for its callback."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    handlers = payment._callback_state_handlers
+
+    assert handlers["FundsLocked"]("payment-1", {}) is True
+    assert handlers["FundsOrDatumInvalid"]("payment-2", {"price": "0"}) is True
+    assert handlers["FundsOrDatumInvalid"]("payment-3", {"price": "5000000"}) is False
+    assert "payment-3" in payment._logged_error_ids
+    assert handlers.get("ResultSubmitted") is None
+
+
+@pytest.mark.parametrize("output_string", [
+    "plain",
+    'quotes " and \\ backslashes',
+    "newline\nand\ttab\x01control",
+    "unicode ü ✓ 😀  ",
+])
+def test_output_hash_escaping_matches_json_dumps(output_string):
+    """The bound string encoder escapes exactly like json.dumps(..., ensure_ascii=False)."""
+    import hashlib
+    import json
+
+    from masumi.helper_functions import create_masumi_output_hash
+
+    escaped = json.dumps(output_string, ensure_ascii=False)[1:-1]
+    expected = hashlib.sha256(f"purchaser-1;{escaped}".encode("utf-8")).hexdigest()
+    assert create_masumi_output_hash(output_string, "purchaser-1") == expected
+
+
+@pytest.mark.asyncio
+async def test_registry_env_fallback_is_read_once(monkeypatch, isolated_process_state):
+    """Registry queries without explicit credentials reuse one environment snapshot."""
+    from masumi.helper_functions import (
+        _registry_env_defaults,
+        check_free_agent_from_registry,
+    )
+
+    monkeypatch.setenv("PAYMENT_SERVICE_URL", "https://first.example/api/v1")
+    monkeypatch.setenv("PAYMENT_API_KEY", "first_key")
+    with patch("masumi.helper_functions.os.getenv", wraps=os.getenv) as getenv_mock:
+        for _ in range(3):
+            assert await check_free_agent_from_registry(agent_identifier="unregistered-agent") is False
+    assert getenv_mock.call_count == 2
+
+    monkeypatch.setenv("PAYMENT_API_KEY", "second_key")
+    assert _registry_env_defaults() == ("https://first.example/api/v1", "first_key")
+
+
+@pytest.mark.asyncio
+async def test_payment_uses_context_config(mock_config, isolated_process_state):
+    """Payment falls back to the context's config, and the setting is scoped per task."""
+    from masumi.config import get_current_config, set_current_config
+
+    other_config = Config(payment_service_url="https://other.example/api/v1", payment_api_key="other_key")
+
+    async def in_task():
+        set_current_config(other_config)
+        return Payment(agent_identifier="agent-123").config
+
+    set_current_config(mock_config)
+    assert Payment(agent_identifier="agent-123").config is mock_config
+    assert await asyncio.create_task(in_task()) is other_config
+    assert get_current_config() is mock_config
+
+
+def test_setup_logging_writes_through_background_queue():
+    """With use_queue=True loggers format in the caller and leave the console write to a writer thread."""
+    import logging
+    import logging.handlers
+
+    from masumi.helper_functions import setup_logging
+
+    plain_logger = setup_logging("masumi.tests.plain_logging")
+    assert [type(h) for h in plain_logger.handlers] == [logging.StreamHandler]
+
+    test_logger = setup_logging("masumi.tests.queue_logging", use_colors=False, use_emojis=False, use_queue=True)
+    (handler,) = test_logger.handlers
+    assert isinstance(handler, logging.handlers.QueueHandler)
+
+    record = test_logger.makeRecord(test_logger.name, logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    prepared = handler.prepare(record)
+    assert prepared.getMessage() == "INFO     tests.queue_logging: hello world"
+
+
+def test_queue_logging_keeps_records_logged_at_exit():
+    """Records logged by atexit hooks, before or after the writer thread stops, reach stderr."""
+    import subprocess
+    import sys
+
+    script = "\n".join([
+        "import atexit, logging",
+        # Registered before masumi, so it runs after the writer thread has stopped
+        "atexit.register(lambda: logging.getLogger('masumi.exit_test').warning('after stop'))",
+        "from masumi.helper_functions import setup_logging",
+        "log = setup_logging('masumi.exit_test', use_colors=False, use_emojis=False, use_queue=True)",
+        "atexit.register(lambda: log.warning('before stop'))",
+        "log.warning('main')",
+    ])
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run([sys.executable, "-c", script], cwd=repo_root, capture_output=True, text=True)
+
+    assert result.returncode == 0
+    messages = [line.split(": ", 1)[-1] for line in result.stderr.splitlines() if "exit_test" in line]
+    assert messages == ["main", "before stop", "after stop"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_queue_logging_works_in_forked_child():
+    """A child forked after the writer thread started still gets its log records written."""
+    import subprocess
+    import sys
+
+    script = "\n".join([
+        "import os, threading",
+        "from masumi.helper_functions import setup_logging",
+        "log = setup_logging('masumi.fork_test', use_colors=False, use_emojis=False, use_queue=True)",
+        "log.warning('parent message')",
+        "pid = os.fork()",
+        "if pid == 0:",
+        "    log.warning('child message')",
+        "    os._exit(0)",
+        "os.waitpid(pid, 0)",
+    ])
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run([sys.executable, "-c", script], cwd=repo_root, capture_output=True, text=True)
+
+    assert result.returncode == 0
+    assert "child message" in result.stderr
+    assert "parent message" in result.stderr
+
+
+@pytest.mark.asyncio
+async def test_payment_and_purchase_reuse_one_connection():
+    """Consecutive Payment and Purchase calls on one Config reuse a single keep-alive connection."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from masumi.purchase import Purchase
+
+    client_ports = []
+
+    async def handler(request):
+        client_ports.append(request.transport.get_extra_info("peername")[1])
+        return web.json_response({"status": "success", "data": {"onChainState": "FundsLocked"}})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/resolve-blockchain-identifier", handler)
+    app.router.add_post("/api/v1/purchase/request-refund", handler)
+
+    async with TestServer(app) as server:
+        config = Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="test_api_key")
+        payment = Payment(agent_identifier="agent-123", config=config)
+        purchase = Purchase(
+            config=config, blockchain_identifier="payment-123", seller_vkey="vkey",
+            agent_identifier="agent-123", pay_by_time=0, submit_result_time=0,
+            unlock_time=0, external_dispute_unlock_time=0,
+        )
+        try:
+            for _ in range(3):
+                await payment.check_payment_status_by_identifier("payment-123")
+            await purchase.request_refund()
+        finally:
+            await config.close()
+
+    assert len(client_ports) == 4
+    assert len(set(client_ports)) == 1
+
+
+@pytest.mark.asyncio
+async def test_watch_status_yields_state_changes_until_complete(mock_config):
+    """watch_status yields only settled state changes and stops once the payment completes."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    locked = {"status": "success", "data": {"onChainState": "FundsLocked",
+                                            "NextAction": {"requestedAction": "SubmitResultRequested"}}}
+    responses = [
+        {"status": "success", "data": None},
+        {"status": "success", "data": {"onChainState": None}},
+        locked,
+        locked,
+        {"status": "success", "data": {"onChainState": "ResultSubmitted",
+                                       "NextAction": {"requestedAction": "WaitingForExternalAction"}}},
+    ]
+    status_mock = AsyncMock(side_effect=responses)
+
+    with patch.object(Payment, "check_payment_status_by_identifier", new=status_mock):
+        states = [data["onChainState"] async for data in payment.watch_status(
+            "payment-123", interval_seconds=0.001, max_interval_seconds=0.002)]
+
+    assert states == ["FundsLocked", "ResultSubmitted"]
+    assert status_mock.await_count == len(responses)
+
+
+@pytest.mark.asyncio
+async def test_read_json_parses_response_bytes():
+    """read_json parses the raw response body into plain dicts/lists."""
+    from masumi.config import read_json
+
+    response = AsyncMock()
+    response.read.return_value = b'{"data": {"Payments": [{"onChainState": "FundsLocked"}]}}'
+    response.json.return_value = {"data": {"Payments": [{"onChainState": "FundsLocked"}]}}
+
+    result = await read_json(response)
+    assert result["data"]["Payments"][0]["onChainState"] == "FundsLocked"
+
+
+@pytest.mark.asyncio
+async def test_generated_identifiers_keep_their_format(mock_config):
+    """Default purchaser identifiers and free-agent payment IDs are random lowercase hex."""
+    import re
+
+    from masumi.models import _default_identifier
+
+    assert re.fullmatch(r"sokosumi-[0-9a-f]{16}", _default_identifier())
+    assert _default_identifier() != _default_identifier()
+
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    mock_payment = await payment.create_free_agent_mock_payment()
+    assert re.fullmatch(r"FREE-[0-9a-f]{24}", mock_payment["data"]["blockchainIdentifier"])
+
+
+def test_env_file_is_loaded_lazily_once(monkeypatch, isolated_process_state):
+    """The .env file is read when configuration falls back to the environment, and only once."""
+    import subprocess
+    import sys
+
+    from masumi.config import get_config_from_env
+    from masumi.helper_functions import _registry_env_defaults
+
+    # Importing the package alone does not look for a .env file
+    importer = (
+        "import sys, dotenv; calls = []; "
+        "dotenv.load_dotenv = lambda *args, **kwargs: calls.append(1); "
+        "import masumi; sys.exit(len(calls))"
+    )
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert subprocess.run([sys.executable, "-c", importer], cwd=repo_root).returncode == 0
+
+    monkeypatch.setenv("PAYMENT_API_KEY", "env_api_key")
+    with patch("dotenv.load_dotenv") as load_dotenv_mock:
+        get_config_from_env()
+        _registry_env_defaults()
+    load_dotenv_mock.assert_called_once_with()
+
+
+def test_config_uses_slots(mock_config):
+    """Config instances carry no per-instance __dict__ and reject unknown attributes."""
+    assert not hasattr(mock_config, "__dict__")
+    with pytest.raises(AttributeError):
+        mock_config.payment_service_ulr = "typo"
+
+
+@pytest.mark.parametrize("url, key, missing", [
+    ("", "key", "PAYMENT_SERVICE_URL"),
+    ("https://payment.example/api/v1", "", "PAYMENT_API_KEY"),
+    ("", "", "PAYMENT_SERVICE_URL, PAYMENT_API_KEY"),
+])
+def test_config_validation_reports_missing_values(url, key, missing):
+    """Config lists every missing required value; free agents need none."""
+    with pytest.raises(ValueError, match=f"Missing required configuration parameters: {missing}"):
+        Config(payment_service_url=url, payment_api_key=key)
+    Config(payment_service_url=url, payment_api_key=key, free_agent=True)
+
+
+@pytest.mark.asyncio
+async def test_registry_check_does_not_log_api_key(caplog):
+    """No part of the API key ends up in the logs of a registry query."""
+    import logging
+    from unittest.mock import MagicMock
+
+    import aiohttp
+
+    from masumi.helper_functions import check_free_agent_from_registry
+
+    session = MagicMock()
+    session.get.side_effect = aiohttp.ClientError("offline")
+
+    with caplog.at_level(logging.DEBUG):
+        assert await check_free_agent_from_registry(
+            agent_identifier="agent-123456789",
+            payment_service_url="https://payment.example/api/v1",
+            payment_api_key="secret-api-key-value",
+            http_session=session,
+        ) is False
+
+    assert caplog.records
+    assert "secret-a" not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_payment_flow_against_local_payment_service():
+    """Create a payment, wait for FundsLocked, submit the result and see it settle, in one flow."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from masumi.helper_functions import (
+        create_masumi_input_hash,
+        create_masumi_output_hash,
+    )
+
+    state = {"onChainState": None, "NextAction": {"requestedAction": "WaitingForExternalAction"}}
+    received = {}
+
+    async def create_payment(request):
+        received["create"] = await request.json()
+        state["onChainState"] = "FundsLocked"
+        state["NextAction"] = {"requestedAction": "SubmitResultRequested"}
+        return web.json_response({"status": "success", "data": {
+            "blockchainIdentifier": "payment-123",
+            "payByTime": "1700000000000",
+            "submitResultTime": "1700000100000",
+            "unlockTime": "1700000200000",
+            "externalDisputeUnlockTime": "1700000300000",
+        }})
+
+    async def resolve(request):
+        body = await request.json()
+        return web.json_response({"status": "success", "data": {"blockchainIdentifier": body["blockchainIdentifier"], **state}})
+
+    async def submit_result(request):
+        received["submit"] = await request.json()
+        state["onChainState"] = "ResultSubmitted"
+        state["NextAction"] = {"requestedAction": "WaitingForExternalAction"}
+        return web.json_response({"status": "success", "data": {}})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/", create_payment)
+    app.router.add_post("/api/v1/payment/resolve-blockchain-identifier", resolve)
+    app.router.add_post("/api/v1/payment/submit-result", submit_result)
+
+    input_data = {"text": "hello"}
+    async with TestServer(app) as server:
+        config = Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="test_api_key")
+        payment = Payment(agent_identifier="agent-123", config=config,
+                          identifier_from_purchaser="purchaser-1", input_data=input_data)
+        try:
+            created = await payment.create_payment_request()
+            blockchain_identifier = created["data"]["blockchainIdentifier"]
+            assert blockchain_identifier in payment.payment_ids
+
+            states = []
+            async for data in payment.watch_status(blockchain_identifier, interval_seconds=0.001):
+                states.append(data["onChainState"])
+                if data["onChainState"] == "FundsLocked":
+                    await payment.complete_payment(blockchain_identifier, "HELLO")
+        finally:
+            await config.close()
+
+    assert states == ["FundsLocked", "ResultSubmitted"]
+    assert received["create"]["inputHash"] == create_masumi_input_hash(input_data, "purchaser-1")
+    assert {k: received["create"][k] for k in ("agentIdentifier", "network", "paymentType", "identifierFromPurchaser")} == {
+        "agentIdentifier": "agent-123",
+        "network": "Preprod",
+        "paymentType": "Web3CardanoV1",
+        "identifierFromPurchaser": "purchaser-1",
+    }
+    assert received["submit"]["submitResultHash"] == create_masumi_output_hash("HELLO", "purchaser-1")
+
+
+def test_uvicorn_log_records_are_handled_once(monkeypatch):
+    """After configuring uvicorn logging, each uvicorn record reaches the console handler exactly once."""
+    import logging
+
+    from masumi.cli import _configure_uvicorn_logging
+
+    _configure_uvicorn_logging()
+    handler = logging.getLogger("uvicorn").handlers[0]
+    handled = []
+    monkeypatch.setattr(handler, "handle", handled.append)
+
+    logging.getLogger("uvicorn.error").info("server started")
+    logging.getLogger("uvicorn.access").info("GET / 200")  # below WARNING, filtered
+    logging.getLogger("uvicorn.access").warning("GET / 500")
+
+    assert [r.getMessage() for r in handled] == ["server started", "GET / 500"]
+    assert logging.getLogger("uvicorn.error").handlers == []
+
+
+@pytest.mark.asyncio
+async def test_free_agent_mock_payment_uses_current_epoch_seconds(free_agent_config):
+    """Mock payment timestamps are whole epoch seconds taken from the current clock."""
+    import time
+
+    payment = Payment(agent_identifier="agent-123", config=free_agent_config,
+                      identifier_from_purchaser="purchaser-1")
+    before = int(time.time())
+    data = (await payment.create_free_agent_mock_payment())["data"]
+    after = int(time.time())
+
+    assert before <= data["payByTime"] <= after
+    assert data["submitResultTime"] == data["payByTime"] + 86400
+
+
+@pytest.mark.asyncio
+async def test_config_context_manager_closes_owned_session():
+    """Leaving `async with Config(...)` closes the session the config created."""
+    async with Config(payment_service_url="http://localhost:3001/api/v1", payment_api_key="test_api_key") as config:
+        session = config.get_http_session()
+        assert config.get_http_session() is session
+    assert session.closed
+
+
+@pytest.mark.asyncio
+async def test_status_monitoring_backs_off_on_failing_checks(mock_config):
+    """A payment whose status checks keep failing is retried with a growing interval."""
+    import aiohttp
+
+    payment = Payment(agent_identifier="agent-123", config=mock_config,
+                      identifier_from_purchaser="purchaser-1")
+    check_times = []
+
+    async def failing_check(blockchain_identifier):
+        check_times.append(asyncio.get_running_loop().time())
+        raise aiohttp.ClientError("payment service unavailable")
+
+    payment.check_payment_status_by_identifier = failing_check
+    await payment.start_status_monitoring(interval_seconds=0.01, max_interval_seconds=0.08)
+    payment.track_payment_id("payment-123")
+    try:
+        await wait_until(lambda: len(check_times) >= 5, timeout=2.0)
+    finally:
+        payment.stop_status_monitoring()
+
+    gaps = [later - earlier for earlier, later in zip(check_times, check_times[1:])]
+    assert gaps[-1] > gaps[0] * 3
+
+
+@pytest.mark.asyncio
+async def test_check_purchase_status_reuses_body_on_not_modified():
+    """A repeated purchase status check sends the previous ETag and reuses the cached body on 304."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    seen_etags = []
+
+    async def purchase_status(request):
+        assert "Content-Type" not in request.headers
+        assert request.headers["token"] == "test_api_key"
+        seen_etags.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.json_response({"status": "success", "data": {"id": "purchase-1"}}, headers={"ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/api/v1/purchase/{purchase_id}", purchase_status)
+
+    async with TestServer(app) as server:
+        async with Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="test_api_key") as config:
+            payment = Payment(agent_identifier="agent-123", config=config)
+            first = await payment.check_purchase_status("purchase-1")
+            first["data"]["id"] = "changed by caller"
+            second = await payment.check_purchase_status("purchase-1")
+            second["data"]["id"] = "changed again"
+            third = await payment.check_purchase_status("purchase-1")
+
+            # The cache is bounded: caching another purchase drops the least recent one
+            payment.PURCHASE_STATUS_CACHE_SIZE = 1
+            await payment.check_purchase_status("purchase-2")
+            await payment.check_purchase_status("purchase-1")
+
+    assert seen_etags == [None, '"v1"', '"v1"', None, None]
+    assert third == {"status": "success", "data": {"id": "purchase-1"}}
+
+
+def test_json_dumps_bytes_matches_json_dumps():
+    """Request bodies are encoded as UTF-8 JSON bytes equal to the str encoding."""
+    from masumi.config import json_dumps, json_dumps_bytes, json_loads
+
+    payload = {"network": "Preprod", "text": "héllo ✓", "amount": 1000000}
+    body = json_dumps_bytes(payload)
+
+    assert isinstance(body, bytes)
+    assert body == json_dumps(payload).encode("utf-8")
+    assert json_loads(body) == payload
+
+
+def test_amount_has_no_instance_dict():
+    """Amount stores its two fields in slots and keeps dataclass equality."""
+    from masumi.payment import Amount
+
+    amount = Amount(amount=1000000, unit="lovelace")
+
+    assert not hasattr(amount, "__dict__")
+    assert amount == Amount(1000000, "lovelace")
+    with pytest.raises(AttributeError):
+        amount.currency = "ADA"
+
+
+def test_payment_and_purchase_headers_are_prebuilt_multidicts(mock_config):
+    """Request headers are built once as a CIMultiDict, so aiohttp can use them without copying."""
+    from multidict import CIMultiDict
+
+    from masumi.purchase import Purchase
+
+    payment = Payment(agent_identifier="agent-123", config=mock_config)
+    purchase = Purchase(config=mock_config, blockchain_identifier="bc-1", seller_vkey="vkey",
+                        agent_identifier="agent-123", identifier_from_purchaser="purchaser-1",
+                        pay_by_time="1", submit_result_time="2", unlock_time="3",
+                        external_dispute_unlock_time="4")
+
+    for headers in (payment._headers, purchase._headers):
+        assert isinstance(headers, CIMultiDict)
+        assert headers["TOKEN"] == "test_api_key"
+        assert headers["content-type"] == "application/json"
+
+
+@pytest.mark.asyncio
+async def test_error_bodies_and_registry_response_read_from_raw_bytes():
+    """Error messages carry the body decoded as UTF-8, and the registry response is parsed from its bytes."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from masumi.helper_functions import check_free_agent_from_registry
+
+    async def bad_request(request):
+        return web.Response(status=400, body="ungültig".encode("utf-8") + b" \xff")
+
+    async def registry(request):
+        return web.json_response({"data": {"Metadata": {"AgentPricing": {"pricingType": "Free"}}}})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/", bad_request)
+    app.router.add_get("/api/v1/registry/agent-identifier", registry)
+
+    async with TestServer(app) as server:
+        base_url = str(server.make_url("/api/v1"))
+        async with Config(payment_service_url=base_url, payment_api_key="test_api_key") as config:
+            payment = Payment(agent_identifier="agent-123", config=config)
+            with pytest.raises(ValueError, match="Bad request: ungültig \ufffd"):
+                await payment.create_payment_request()
+            assert await check_free_agent_from_registry(
+                agent_identifier="agent-123",
+                payment_service_url=base_url,
+                payment_api_key="test_api_key",
+                http_session=config.get_http_session(),
+            ) is True
+
+
+@pytest.mark.asyncio
+async def test_status_monitoring_stops_after_max_duration(mock_config):
+    """Monitoring with max_duration_seconds ends on its own even while a payment is still pending."""
+    payment = Payment(agent_identifier="agent-123", config=mock_config,
+                      identifier_from_purchaser="purchaser-1")
+    pending = {"status": "success", "data": {"onChainState": None, "NextAction": {"requestedAction": "WaitingForExternalAction"}}}
+    payment.check_payment_status_by_identifier = AsyncMock(return_value=pending)
+    payment.track_payment_id("payment-123")
+
+    await payment.start_status_monitoring(interval_seconds=0.01, max_duration_seconds=0.05)
+    first_task = payment._status_check_task
+
+    assert await payment.wait_for_status_monitoring(timeout=2.0) is True
+    assert first_task.done() and not first_task.cancelled()
+    assert "payment-123" in payment.payment_ids
+    assert payment.check_payment_status_by_identifier.await_count >= 1
+
+
+@pytest.mark.asyncio
+async def test_create_payment_requests_bounds_concurrency_and_keeps_order(mock_config):
+    """create_payment_requests runs at most `concurrency` creations at once and returns results in order."""
+    from masumi.payment import create_payment_requests
+
+    in_flight = 0
+    peak = 0
+
+    def fake_create(index):
+        async def create(metadata=None):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            if index == 3:
+                raise ValueError("Bad request: duplicate")
+            return {"data": {"blockchainIdentifier": f"payment-{index}", "metadata": metadata}}
+        return create
+
+    payments = []
+    for index in range(6):
+        payment = Payment(agent_identifier="agent-123", config=mock_config)
+        payment.create_payment_request = fake_create(index)
+        payments.append(payment)
+
+    results = await create_payment_requests(payments, metadata="batch", concurrency=2)
+
+    assert peak == 2
+    assert isinstance(results[3], ValueError)
+    assert [r["data"]["blockchainIdentifier"] for i, r in enumerate(results) if i != 3] == [
+        "payment-0", "payment-1", "payment-2", "payment-4", "payment-5"
+    ]
+    assert results[0]["data"]["metadata"] == "batch"
+
+
+@pytest.mark.asyncio
+async def test_status_check_skips_debug_logging_when_disabled():
+    """With debug logging off, a status check does not call logger.debug at all."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    import masumi.payment as payment_module
+
+    async def resolve(request):
+        return web.json_response({"status": "success", "data": {"onChainState": "FundsLocked"}})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/resolve-blockchain-identifier", resolve)
+
+    async with TestServer(app) as server:
+        async with Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="test_api_key") as config:
+            payment = Payment(agent_identifier="agent-123", config=config)
+            with patch.object(payment_module.logger, "isEnabledFor", return_value=False), \
+                    patch.object(payment_module.logger, "debug") as debug:
+                result = await payment.check_payment_status_by_identifier("payment-123")
+
+    assert result["data"]["onChainState"] == "FundsLocked"
+    debug.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_final_payment_status_is_not_requested_again():
+    """After a payment reports a withdrawn state, later status checks return it without a request."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    states = ["ResultSubmitted", "Withdrawn"]
+    requests_seen = []
+
+    async def resolve(request):
+        requests_seen.append((await request.json())["blockchainIdentifier"])
+        return web.json_response({"status": "success", "data": {"onChainState": states[min(len(requests_seen), 2) - 1]}})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/resolve-blockchain-identifier", resolve)
+
+    async with TestServer(app) as server:
+        async with Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="test_api_key") as config:
+            payment = Payment(agent_identifier="agent-123", config=config)
+            observed = [
+                (await payment.check_payment_status_by_identifier("payment-123"))["data"]["onChainState"]
+                for _ in range(4)
+            ]
+            assert len(requests_seen) == 2
+
+            # Cached results are copies: modifying one does not change later ones
+            cached = await payment.check_payment_status_by_identifier("payment-123")
+            cached["data"]["onChainState"] = "changed by caller"
+            assert (await payment.check_payment_status_by_identifier("payment-123"))["data"]["onChainState"] == "Withdrawn"
+
+            # Untracking forgets the cached status, and the cache is bounded
+            payment.untrack_payment_id("payment-123")
+            await payment.check_payment_status_by_identifier("payment-123")
+            payment.FINAL_STATUS_CACHE_SIZE = 1
+            await payment.check_payment_status_by_identifier("payment-456")
+            await payment.check_payment_status_by_identifier("payment-123")
+
+    assert observed == ["ResultSubmitted", "Withdrawn", "Withdrawn", "Withdrawn"]
+    assert requests_seen == ["payment-123", "payment-123", "payment-123", "payment-456", "payment-123"]
+
+
+@pytest.mark.asyncio
+async def test_status_monitoring_error_traceback_only_when_debugging(mock_config):
+    """A failing monitoring round is logged with its traceback only when debug logging is on."""
+    import masumi.payment as payment_module
+
+    class BrokenIds(set):
+        def __iter__(self):
+            raise RuntimeError("broken round")
+
+    for debug_enabled in (False, True):
+        payment = Payment(agent_identifier="agent-123", config=mock_config)
+        payment.payment_ids = BrokenIds({"payment-123"})
+        with patch.object(payment_module.logger, "isEnabledFor", return_value=debug_enabled), \
+                patch.object(payment_module.logger, "error") as error:
+            await payment.start_status_monitoring(interval_seconds=0.01)
+            try:
+                await wait_until(lambda: error.called)
+            finally:
+                payment.stop_status_monitoring()
+
+        assert "broken round" in error.call_args.args[0]
+        assert error.call_args.kwargs["exc_info"] is debug_enabled
+
+
+@pytest.mark.asyncio
+async def test_server_monitors_all_job_payments_in_one_task(mock_config):
+    """Payments of different jobs share one monitoring task and each job's callback gets its own payment."""
+    from masumi.server import MasumiAgentServer
+
+    server = MasumiAgentServer(config=mock_config, agent_identifier="agent-123", seller_vkey="vkey")
+    locked = {"status": "success", "data": {"onChainState": "FundsLocked",
+                                            "NextAction": {"requestedAction": "SubmitResultRequested"}}}
+    confirmed = {}
+
+    def job_callback(job_id):
+        async def callback(payment):
+            confirmed[job_id] = payment["blockchainIdentifier"]
+        return callback
+
+    async def check_status(blockchain_identifier):
+        return {**locked, "data": {**locked["data"], "blockchainIdentifier": blockchain_identifier}}
+
+    with patch.object(Payment, "check_payment_status_by_identifier", side_effect=check_status):
+        await server._monitor_payment("payment-1", job_callback("job-1"))
+        monitor_task = server._payment_monitor._status_check_task
+        await server._monitor_payment("payment-2", job_callback("job-2"))
+        try:
+            await wait_until(lambda: len(confirmed) == 2)
+            assert server._payment_monitor._status_check_task is monitor_task
+        finally:
+            await server.cleanup_background_tasks()
+
+    assert confirmed == {"job-1": "payment-1", "job-2": "payment-2"}
+    assert not server._payment_monitor.is_monitoring
+
+
+@pytest.mark.asyncio
+async def test_server_monitor_restart_keeps_pending_callbacks(mock_config):
+    """Restarting the finished shared monitor for a new job does not cancel earlier jobs' callbacks."""
+    from masumi.server import MasumiAgentServer
+
+    server = MasumiAgentServer(config=mock_config, agent_identifier="agent-123", seller_vkey="vkey")
+    release = asyncio.Event()
+    confirmed = []
+
+    def job_callback(job_id, wait=False):
+        async def callback(payment):
+            if wait:
+                await release.wait()
+            confirmed.append(job_id)
+        return callback
+
+    checks = []
+
+    async def check_status(blockchain_identifier):
+        # The first check locks the funds; the next one reports the job's payment as complete
+        state = "ResultSubmitted" if blockchain_identifier in checks else "FundsLocked"
+        checks.append(blockchain_identifier)
+        return {"status": "success", "data": {"onChainState": state,
+                                              "blockchainIdentifier": blockchain_identifier,
+                                              "NextAction": {"requestedAction": "SubmitResultRequested"}}}
+
+    # Poll every 10ms so payment-1 completes and the monitor exits while its callback still runs
+    with patch.object(Payment, "check_payment_status_by_identifier", side_effect=check_status), \
+            patch.object(Payment, "_next_poll_delay", return_value=0.01), \
+            patch.object(Payment, "_poll_jitter", return_value=0.0):
+        await server._monitor_payment("payment-1", job_callback("job-1", wait=True))
+        monitor = server._payment_monitor
+        try:
+            await wait_until(lambda: not monitor.is_monitoring and monitor._callback_tasks)
+            await server._monitor_payment("payment-2", job_callback("job-2"))
+            await wait_until(lambda: "job-2" in confirmed)
+            release.set()
+            await wait_until(lambda: "job-1" in confirmed)
+        finally:
+            await server.cleanup_background_tasks()
+
+    assert sorted(confirmed) == ["job-1", "job-2"]
+
+
+def test_poll_jitter_spreads_checks_within_fifteen_percent():
+    """Status check jitter stays within ±15% of the delay and varies between checks."""
+    offsets = [Payment._poll_jitter(10.0) for _ in range(200)]
+
+    assert all(-1.5 <= offset <= 1.5 for offset in offsets)
+    assert len(set(offsets)) > 1
+
+
+@pytest.mark.asyncio
+async def test_rejected_api_key_fails_fast_until_retry_window_passes(isolated_process_state):
+    """After a 401, calls with the same API key raise without a request until the retry window passes."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from masumi.config import REJECTED_API_KEY_RETRY_SECONDS, _rejected_api_keys
+    from masumi.purchase import Purchase
+
+    requests_seen = []
+
+    async def unauthorized(request):
+        requests_seen.append(request.path)
+        return web.Response(status=401)
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/", unauthorized)
+    app.router.add_post("/api/v1/purchase/request-refund", unauthorized)
+
+    async with TestServer(app) as server:
+        async with Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="bad_key") as config:
+            payment = Payment(agent_identifier="agent-123", config=config)
+            purchase = Purchase(config=config, blockchain_identifier="bc-1", seller_vkey="vkey",
+                                agent_identifier="agent-123", pay_by_time=0, submit_result_time=0,
+                                unlock_time=0, external_dispute_unlock_time=0)
+
+            for _ in range(2):
+                with pytest.raises(ValueError, match="Unauthorized"):
+                    await payment.create_payment_request()
+            with pytest.raises(ValueError, match="Unauthorized"):
+                await purchase.request_refund()
+            assert requests_seen == ["/api/v1/payment/"]
+
+            _rejected_api_keys["bad_key"] -= REJECTED_API_KEY_RETRY_SECONDS
+            with pytest.raises(ValueError, match="Unauthorized"):
+                await payment.create_payment_request()
+            assert requests_seen == ["/api/v1/payment/", "/api/v1/payment/"]
+
+
+@pytest.mark.asyncio
+async def test_stop_status_monitoring_ends_waiting_monitor_immediately(mock_config):
+    """Stopping a monitor that is waiting (idle or backing off) cancels it right away."""
+    pending = {"status": "success", "data": {"onChainState": None, "NextAction": {"requestedAction": "WaitingForExternalAction"}}}
+
+    for tracked in (False, True):
+        payment = Payment(agent_identifier="agent-123", config=mock_config)
+        payment.check_payment_status_by_identifier = AsyncMock(return_value=pending)
+        if tracked:
+            payment.track_payment_id("payment-123")
+        await payment.start_status_monitoring(interval_seconds=3600)
+        task = payment._status_check_task
+        if tracked:
+            await wait_until(lambda: payment.check_payment_status_by_identifier.await_count == 1)
+        await asyncio.sleep(0)
+
+        payment.stop_status_monitoring()
+        await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), timeout=0.5)
+
+        assert task.cancelled()
+        assert not payment.is_monitoring
+
+
+@pytest.mark.asyncio
+async def test_retry_async_retries_only_transient_errors():
+    """retry_async retries network errors with backoff and lets other errors through at once."""
+    import aiohttp
+
+    from masumi.helper_functions import TRANSIENT_ERRORS, retry_async
+
+    calls = []
+
+    async def flaky(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise aiohttp.ClientConnectionError("connection reset")
+        return value
+
+    assert await retry_async(flaky, "ok", attempts=3, base_delay=0.001, retry_on=TRANSIENT_ERRORS) == "ok"
+    assert calls == ["ok", "ok", "ok"]
+
+    async def broken():
+        calls.append("broken")
+        raise ValueError("Bad request: invalid hash")
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        await retry_async(broken, attempts=3, base_delay=0.001, retry_on=TRANSIENT_ERRORS)
+    assert calls == ["broken"]
+
+    calls.clear()
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await retry_async(flaky, "never", attempts=2, base_delay=0.001, retry_on=TRANSIENT_ERRORS)
+    assert calls == ["never", "never"]
+
+    # By default a dropped connection is not retried: the request may have been received
+    calls.clear()
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await retry_async(flaky, "once", attempts=3, base_delay=0.001)
+    assert calls == ["once"]
+
+    async def refused():
+        calls.append("refused")
+        if len(calls) < 2:
+            connection_key = Mock(host="localhost", port=3001, ssl=True)
+            raise aiohttp.ClientConnectorError(connection_key, OSError(111, "Connection refused"))
+        return "sent"
+
+    calls.clear()
+    assert await retry_async(refused, attempts=3, base_delay=0.001) == "sent"
+    assert calls == ["refused", "refused"]
+
+
+@pytest.mark.asyncio
+async def test_set_job_completed_does_not_resend_a_result_the_service_may_have_received():
+    """A connection dropped after submit-result was sent is not retried (the POST is not idempotent)."""
+    import aiohttp
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    submissions = []
+
+    async def submit_result(request):
+        submissions.append(await request.read())
+        # Drop the connection before answering, as if the response were lost
+        request.transport.close()
+        return web.Response(status=200)
+
+    app = web.Application()
+    app.router.add_post("/api/v1/payment/submit-result", submit_result)
+
+    async with TestServer(app) as server:
+        async with Config(payment_service_url=str(server.make_url("/api/v1")), payment_api_key="test_api_key") as config:
+            manager = JobManager()
+            manager.RESULT_SUBMIT_RETRY_DELAY = 0.001
+            payment = Payment(agent_identifier="agent-123", config=config)
+            job_id = await manager.create_job(
+                identifier_from_purchaser="purchaser-123", input_data={"text": "test"},
+                payment=payment, blockchain_identifier="blockchain-123", pay_by_time=int((time.time() + 3600) * 1000),
+                submit_result_time=0, unlock_time=0, external_dispute_unlock_time=0,
+                agent_identifier="agent-123", seller_vkey="seller-key-123",
+            )
+            await manager.set_job_running(job_id)
+
+            with pytest.raises(aiohttp.ClientConnectionError):
+                await manager.set_job_completed(job_id, "result")
+
+    assert len(submissions) == 1
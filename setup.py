@@ -14,16 +14,21 @@ setup(
     package_dir={'masumi': 'masumi'},
     install_requires=[
         "aiohttp>=3.8.0",
+        "multidict>=4.5",
         "pytest>=7.0.0",
         "pytest-asyncio>=0.18.0",
         "canonicaljson>=1.6.3",
         "fastapi>=0.100.0",
         "uvicorn[standard]>=0.23.0",
+        "uvloop>=0.17.0; platform_system != 'Windows'",
         "pydantic>=2.0.0",
         "python-dotenv>=0.19.0",
         "InquirerPy>=0.3.4",
         "pip-system-certs>=4.0.0",
     ],
+    extras_require={
+        "speedups": ["orjson>=3.6.0"],
+    },
     author="Patrick Tobler",
     author_email="patrick@nmkr.io",
     description="Masumi Payment Module for Cardano blockchain integration",